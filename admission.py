@@ -0,0 +1,115 @@
+#
+# admission control for the request handlers: token buckets limiting
+# how fast each client may call each route, a cap on concurrent calls,
+# and counters of what was admitted and rejected. Like the caches,
+# everything here is per app instance and bounded.
+#
+import threading
+import time
+from collections import OrderedDict
+
+class TokenBucket(object):
+    """
+    a bucket of up to burst tokens, refilled at rate tokens a second.
+    take() spends a token if there is one.
+
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.time()
+
+    def take(self, now=None):
+        """
+        Returns: True if a token was spent, False if the bucket is empty
+        """
+        if now is None:
+            now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait(self):
+        """seconds until the bucket next has a token"""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class Admission(object):
+    """
+    a token bucket for each (client, route) pair, holding at most
+    maxbuckets of them (the least recently used go first: a client
+    forgotten that way just gets a full bucket), and counts by route of
+    the requests admitted and of those rejected, by reason.
+
+    """
+    def __init__(self, maxbuckets=10000):
+        self.maxbuckets = maxbuckets
+        self._buckets = OrderedDict()
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def admit(self, client, route, rate, burst):
+        """
+        take a token from the bucket for client and route, which fills
+        at rate tokens a second up to burst.
+
+        Returns: 0 if the request is admitted, otherwise the seconds the
+        client should wait before trying again
+        """
+        key = (client, route)
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.maxbuckets:
+                self._buckets.popitem(last=False)
+            if bucket.take():
+                return 0
+            return bucket.wait()
+
+    def count(self, route, outcome):
+        """count a request to route as outcome ('admitted' or a reason)"""
+        with self._lock:
+            key = (route, outcome)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def stats(self):
+        """
+        Returns: dictionary of counts by outcome, by route, and the
+        number of client buckets held
+        """
+        with self._lock:
+            routes = {}
+            for (route, outcome), n in self._counts.items():
+                routes.setdefault(route, {})[outcome] = n
+            return {'routes': routes, 'buckets': len(self._buckets)}
+
+class ConcurrencyLimit(object):
+    """
+    at most limit holders at once: enter() returns False rather than
+    waiting when the limit is reached, and a True enter() must be paired
+    with an exit().
+
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def exit(self):
+        with self._lock:
+            self.active -= 1
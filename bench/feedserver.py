@@ -0,0 +1,158 @@
+#
+# local stand-in for the ticketing site's iCal feed: a synthetic
+# multi-season schedule served over HTTP on localhost, with switchable
+# ETag / Last-Modified support so that conditional fetches (200, 304,
+# and a 200 with an unchanged body) can be exercised without the network.
+#
+# python bench/feedserver.py [--port 8081] [--seasons 3]
+#
+import argparse
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from hashlib import sha1
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+OPPONENTS = ['Dodgers', 'Padres', 'Rockies', 'D-backs', 'Cubs', 'Mets',
+             'Phillies', 'Brewers', 'Cardinals', 'Reds', 'Pirates', 'Marlins',
+             'Braves', 'Nationals', 'Athletics', 'Mariners', 'Angels']
+
+def synthetic_feed(seasons=1, first_year=None, seed=0, final_before=None):
+    """
+    an iCal feed shaped like the Giants ticketing feed: a 162 game season
+    per year starting late March, in home and away series of three or
+    four games with the odd off day and doubleheader. Games before
+    final_before (a date) are named FINAL, as the real feed does once
+    they have been played.
+
+    Returns: unicode iCal text with CRLF line endings
+    """
+    rnd = random.Random(seed)
+    if first_year is None:
+        first_year = date.today().year
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0',
+             'PRODID:-//sportsball//synthetic feed//EN', 'METHOD:PUBLISH']
+    uid = 0
+    for year in range(first_year, first_year + seasons):
+        day, games = date(year, 3, 28), 0
+        while games < 162:
+            home = rnd.random() < 0.5
+            them = rnd.choice(OPPONENTS)
+            for _ in range(rnd.choice((3, 3, 4))):
+                starts = [19] if rnd.random() > 0.03 else [13, 19]
+                for hour in starts:
+                    uid += 1
+                    games += 1
+                    # Pacific game time as UTC, close enough for a fixture
+                    begin = datetime(day.year, day.month, day.day,
+                                     hour, 15) + timedelta(hours=7)
+                    name = ('%s vs. Giants' % them if home else
+                            'Giants vs. %s' % them)
+                    if final_before and day < final_before:
+                        name = 'FINAL: ' + name
+                    lines += [
+                        'BEGIN:VEVENT',
+                        'DTSTAMP:%s' % begin.strftime('%Y0101T000000Z'),
+                        'DTSTART:%s' % begin.strftime('%Y%m%dT%H%M%SZ'),
+                        'DTEND:%s' % (begin + timedelta(hours=3)).strftime(
+                            '%Y%m%dT%H%M%SZ'),
+                        'SUMMARY:%s' % name,
+                        'LOCATION:%s' % ('Oracle Park - San Francisco' if home
+                                         else '%s Ballpark' % them),
+                        'DESCRIPTION:Game %d\\, %s at %s\\nTickets' % (
+                            games, them, 'home' if home else 'away'),
+                        'UID:%d-%d@synthetic.sportsball' % (year, uid),
+                        'END:VEVENT']
+                day += timedelta(days=1)
+            if rnd.random() < 0.4:
+                day += timedelta(days=1) # off day
+    lines.append('END:VCALENDAR')
+    return u'\r\n'.join(lines) + u'\r\n'
+
+class FeedServer(ThreadingMixIn, HTTPServer):
+    """
+    threaded HTTP server for one feed body on 127.0.0.1. With validators
+    on, responses carry an ETag (sha1 of the body) and Last-Modified (the
+    time the body was set) and requests carrying matching If-None-Match
+    or If-Modified-Since headers get a 304. With validators off every
+    request gets the full body. log records (path, status) per request.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, feed=None, port=0, validators=True):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FeedHandler)
+        self.validators = validators
+        self.log = []
+        self.set_feed(feed if feed is not None else synthetic_feed())
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/ical' % self.server_address[1]
+
+    def set_feed(self, feed):
+        if isinstance(feed, unicode):
+            feed = feed.encode('iso-8859-1')
+        self.body = feed
+        self.etag = '"%s"' % sha1(feed).hexdigest()
+        self.modified = int(time.time())
+
+    def start(self):
+        """serve from a daemon thread. Returns: self"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        if server.validators and self.not_modified():
+            status = 304
+            self.send_response(status)
+            self.end_headers()
+        else:
+            status = 200
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/calendar; charset=iso-8859-1')
+            self.send_header('Content-Length', str(len(server.body)))
+            if server.validators:
+                self.send_header('ETag', server.etag)
+                self.send_header('Last-Modified',
+                                 formatdate(server.modified, usegmt=True))
+            self.end_headers()
+            self.wfile.write(server.body)
+        server.log.append((self.path, status))
+
+    def not_modified(self):
+        etags = self.headers.getheader('If-None-Match')
+        if etags is not None:
+            return self.server.etag in [t.strip() for t in etags.split(',')]
+        since = self.headers.getheader('If-Modified-Since')
+        if since is not None:
+            parsed = parsedate_tz(since)
+            return parsed is not None and self.server.modified <= mktime_tz(parsed)
+        return False
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='serve a synthetic feed')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--no-validators', dest='validators',
+                        action='store_false')
+    args = parser.parse_args()
+    server = FeedServer(synthetic_feed(args.seasons), port=args.port,
+                        validators=args.validators)
+    print 'serving %d bytes at %s' % (len(server.body), server.url)
+    server.serve_forever()
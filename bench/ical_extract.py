@@ -0,0 +1,135 @@
+#
+# differential check and benchmark for schedule.feed_games, the fast path
+# get_feed takes through the ical feed, against the full ics.Calendar
+# parse it replaced. Both paths are run over the same synthetic feeds
+# (bench/feedserver.py) and their event dictionaries must match exactly;
+# then each is timed on a large multi-season feed.
+#
+# Needs the App Engine SDK importable, eg:
+# PYTHONPATH=path/to/google_appengine python bench/ical_extract.py --seasons 20
+#
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+try:
+    import dev_appserver # App Engine SDK: google.appengine and its libraries
+    dev_appserver.fix_sys_path()
+except ImportError:
+    pass
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'lib')]
+
+from ics import Calendar
+import schedule
+from feedserver import synthetic_feed
+
+VTIMEZONE = u'''BEGIN:VTIMEZONE
+TZID:America/Los_Angeles
+X-LIC-LOCATION:America/Los_Angeles
+BEGIN:DAYLIGHT
+TZOFFSETFROM:-0800
+TZOFFSETTO:-0700
+TZNAME:PDT
+DTSTART:19700308T020000
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=2SU
+END:DAYLIGHT
+BEGIN:STANDARD
+TZOFFSETFROM:-0700
+TZOFFSETTO:-0800
+TZNAME:PST
+DTSTART:19701101T020000
+RRULE:FREQ=YEARLY;BYMONTH=11;BYDAY=1SU
+END:STANDARD
+END:VTIMEZONE
+'''.replace(u'\n', u'\r\n')
+
+def pacific(utc_value):
+    """the ical UTC date-time value as (roughly) Pacific local time"""
+    local = datetime.strptime(utc_value, '%Y%m%dT%H%M%S') - timedelta(hours=7)
+    return local.strftime('%Y%m%dT%H%M%S')
+
+def variants(seasons):
+    """
+    Returns: list of (description, feed text) covering the property
+    forms feed_games decodes itself and those it hands to ics
+    """
+    plain = synthetic_feed(seasons)
+    zoned = re.sub(u'(DTSTART|DTEND):(\\d{8}T\\d{6})Z',
+                   lambda m: u'%s;TZID=America/Los_Angeles:%s' % (
+                       m.group(1), pacific(m.group(2))),
+                   plain.replace(u'METHOD:PUBLISH\r\n',
+                                 u'METHOD:PUBLISH\r\n' + VTIMEZONE))
+    dated = re.sub(u'DTSTART:(\\d{8})T\\d{6}Z', u'DTSTART;VALUE=DATE:\\1',
+                   re.sub(u'DTEND:.*\r\n', u'', plain))
+    quoted = zoned.replace(u';TZID=America/Los_Angeles:',
+                           u';TZID="America/Los_Angeles":')
+    folded = re.sub(u'(SUMMARY|LOCATION):(.{6})', u'\\1:\\2\r\n ', plain)
+    escaped = plain.replace(u' - San Francisco', u'\\, San Francisco\\; CA')
+    unknown_tz = plain.replace(u'Z\r\nDTEND', u'\r\nDTEND').replace(
+        u'DTSTART:', u'DTSTART;TZID=Nowhere/Special:').replace(
+        u'DTEND:', u'DTEND;TZID=Nowhere/Special:').replace(u'Z\r\n', u'\r\n')
+    return [('utc', plain), ('tzid+vtimezone', zoned),
+            ('quoted tzid', quoted), ('value=date', dated),
+            ('folded', folded), ('escaped', escaped),
+            ('unknown tzid', unknown_tz)]
+
+def lines(text):
+    return [line.rstrip(u'\r') for line in text.split(u'\n')]
+
+def fast_events(text):
+    events = [schedule.feed_event(*game)
+              for game in schedule.feed_games(lines(text))]
+    return sorted([e for e in events if e], key=lambda e: e[0])
+
+def ics_events(text):
+    events = [schedule.feed_event(event.name, event.location, event.begin)
+              for event in Calendar(text).events]
+    return sorted([e for e in events if e], key=lambda e: e[0])
+
+def same_events(a, b):
+    """
+    whether two (begin, event) lists hold the same events in the same
+    begin order; the order of events that begin at the same instant
+    isn't defined by either path.
+    """
+    key = lambda e: (e[0], sorted(e[1].items()))
+    return sorted(a, key=key) == sorted(b, key=key) and (
+        [begin for begin, e in a] == [begin for begin, e in b])
+
+def best_time(fn, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn(arg)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='compare and time feed_games against ics.Calendar')
+    parser.add_argument('--seasons', type=int, default=10,
+                        help='seasons in the benchmark feed')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    for description, text in variants(2):
+        fast, full = fast_events(text), ics_events(text)
+        same = same_events(fast, full)
+        failed = failed or not same
+        print '%-16s %4d events  %s' % (description, len(full),
+                                        'same' if same else 'DIFFERENT')
+
+    text = synthetic_feed(args.seasons)
+    count = text.count(u'BEGIN:VEVENT')
+    print '\n%d seasons, %d events, %d bytes' % (args.seasons, count, len(text))
+    full = best_time(ics_events, text, args.repeat)
+    fast = best_time(fast_events, text, args.repeat)
+    print 'ics.Calendar  %10.0f events/sec' % (count / full)
+    print 'feed_games    %10.0f events/sec  (%.1fx)' % (count / fast, full / fast)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,253 @@
+#
+# in-process load test for sportsball.app: drives the WSGI app directly
+# with a configurable mix of requests and reports requests/sec, latency
+# percentiles and allocations per request, overall and per route.
+#
+# The app runs against local stand-ins: the SDK's in-memory (or sqlite)
+# datastore stub for db, bench/localqueue.py for deferred, the synthetic
+# multi-season feed served by bench/feedserver.py for the feed url, and
+# optionally a trivial renderer in place of the Django template.
+#
+# Needs the App Engine SDK importable, eg:
+# PYTHONPATH=path/to/google_appengine python bench/loadtest.py \
+#     --mix index=50,eightball=30,schedule=15,refresh=5 --requests 5000
+#
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, timedelta
+
+try:
+    import dev_appserver # App Engine SDK: google.appengine and its libraries
+    dev_appserver.fix_sys_path()
+except ImportError:
+    pass
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_ROOT = os.path.dirname(ROOT)
+sys.path[:0] = [APP_ROOT, os.path.join(APP_ROOT, 'lib')]
+
+try:
+    import tracemalloc # python 3, or pytracemalloc
+except ImportError:
+    tracemalloc = None
+
+VERBS = ['hosed', 'doomed', 'ruined', 'jammed', 'busy']
+
+def stand_ins(datastore='memory'):
+    """
+    activate a testbed with the datastore stub (in memory, or sqlite in
+    a temporary file) and the other services the app touches.
+
+    Returns: the active testbed
+    """
+    from google.appengine.ext import testbed
+    os.environ.setdefault('APPLICATION_ID', 'sportsball-bench')
+    os.chdir(APP_ROOT) # templates are found relative to the app
+    bed = testbed.Testbed()
+    bed.activate()
+    if datastore == 'sqlite':
+        bed.init_datastore_v3_stub(use_sqlite=True,
+                                   datastore_file=tempfile.mktemp('.sqlite'))
+    else:
+        bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=APP_ROOT)
+    return bed
+
+def local_feed(schedule, server):
+    """point every feed fetch schedule makes at the fixture server"""
+    from urllib2 import Request, urlopen
+    def urlopen_local(request, timeout=None):
+        local = Request(server.url, headers=dict(request.header_items()))
+        return urlopen(local, timeout=timeout)
+    schedule.urlopen = urlopen_local
+
+def plain_render(path, values):
+    """stand-in for sportsball.render, to leave Django out of the timings"""
+    return (u'<html><h1>Is my day %(verb)s?</h1>%(today)s<br>%(tomorrow)s'
+            % values)
+
+def parse_mix(mix):
+    """
+    Returns: list of (route, weight) from 'route=weight,...'
+    """
+    weights = []
+    for item in mix.split(','):
+        route, _, weight = item.partition('=')
+        if route not in ROUTES:
+            raise ValueError("unknown route %r, not one of %s" % (
+                    route, ', '.join(sorted(ROUTES))))
+        weights.append((route, float(weight or 1)))
+    return weights
+
+ROUTES = {
+    'index': lambda rnd, days: '/',
+    'eightball': lambda rnd, days: '/%s/%s' % (rnd.choice(VERBS),
+                                               rnd.choice(days)),
+    'schedule': lambda rnd, days: '/schedule.json',
+    'refresh': lambda rnd, days: '/refresh',
+    'range': lambda rnd, days: '/range?from=%s&to=%s' % (days[0], days[-1]),
+}
+
+def requests(mix, count, days, clients, seed=0):
+    """
+    Returns: list of (route, path, client address) drawn from mix
+    """
+    rnd = random.Random(seed)
+    routes, cumulative, total = [], [], 0
+    for route, weight in mix:
+        total += weight
+        routes.append(route)
+        cumulative.append(total)
+    drawn = []
+    for _ in xrange(count):
+        route = routes[bisect_right(cumulative, rnd.random() * total)]
+        n = rnd.randrange(clients)
+        client = '10.%d.%d.%d' % (n >> 16 & 255, n >> 8 & 255, n & 255)
+        drawn.append((route, ROUTES[route](rnd, days), client))
+    return drawn
+
+def call(app, path, client, gzip):
+    """
+    run one request through the WSGI app. Returns: its status code
+    """
+    from webob import Request
+    environ = Request.blank(path, remote_addr=client).environ
+    if gzip:
+        environ['HTTP_ACCEPT_ENCODING'] = 'gzip'
+    status = []
+    def start_response(s, headers, exc_info=None):
+        status.append(s)
+    result = app(environ, start_response)
+    for _ in result:
+        pass
+    if hasattr(result, 'close'):
+        result.close()
+    return int(status[0][:3])
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(p / 100.0 * len(sorted_values)))]
+
+def run(app, drawn, gzip=False, threads=1):
+    """
+    drive app with the drawn requests from threads threads.
+
+    Returns: (wall seconds, list of (route, status, seconds, allocations))
+    """
+    results = []
+    lock = threading.Lock()
+    work = list(reversed(drawn))
+    def worker():
+        while True:
+            with lock:
+                if not work:
+                    return
+                route, path, client = work.pop()
+            allocated = allocations()
+            start = time.time()
+            status = call(app, path, client, gzip)
+            elapsed = time.time() - start
+            allocated = allocations() - allocated
+            with lock:
+                results.append((route, status, elapsed, allocated))
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.time() - start, results
+
+def allocations():
+    """
+    a running count of allocation: bytes allocated and not yet freed,
+    with tracemalloc, or else the objects the garbage collector tracks,
+    net of those freed. With more than one thread, requests running at
+    the same time are charged for each other's allocations.
+    """
+    if tracemalloc is not None:
+        return tracemalloc.get_traced_memory()[0]
+    return gc.get_count()[0]
+
+def report(wall, results):
+    print '%-10s %7s %9s %8s %8s %8s %10s  %s' % (
+        'route', 'reqs', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'bytes/req' if tracemalloc else 'net objs', 'statuses')
+    routes = sorted(set(route for route, _, _, _ in results))
+    for route in routes + ['all']:
+        rows = [r for r in results if route in ('all', r[0])]
+        latencies = sorted(elapsed for _, _, elapsed, _ in rows)
+        statuses = {}
+        for _, status, _, _ in rows:
+            statuses[status] = statuses.get(status, 0) + 1
+        # route rates are their share of the whole run's wall time
+        print '%-10s %7d %9.0f %8.2f %8.2f %8.2f %10.0f  %s' % (
+            route, len(rows), len(rows) / wall,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000,
+            sum(a for _, _, _, a in rows) / float(len(rows)),
+            ' '.join('%d:%d' % item for item in sorted(statuses.items())))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='load test sportsball.app')
+    parser.add_argument('--mix', default='index=50,eightball=30,schedule=15,'
+                        'refresh=5', help='route=weight,... from %s' %
+                        ', '.join(sorted(ROUTES)))
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200,
+                        help='requests run before timing starts')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=100000,
+                        help='distinct client addresses requests come from')
+    parser.add_argument('--seasons', type=int, default=3)
+    parser.add_argument('--datastore', choices=('memory', 'sqlite'),
+                        default='memory')
+    parser.add_argument('--stub-templates', action='store_true',
+                        help='render pages without Django')
+    parser.add_argument('--gzip', action='store_true',
+                        help='send Accept-Encoding: gzip')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    bed = stand_ins(args.datastore)
+    import schedule
+    from feedserver import FeedServer, synthetic_feed
+    from localqueue import LocalQueue
+    server = FeedServer(synthetic_feed(args.seasons)).start()
+    local_feed(schedule, server)
+    queue = LocalQueue().install(schedule)
+    import sportsball
+    if args.stub_templates:
+        sportsball.render = plain_render
+
+    first = date(date.today().year, 3, 20)
+    days = [(first + timedelta(days=n)).isoformat() for n in range(225)]
+    mix = parse_mix(args.mix)
+    drawn = requests(mix, args.warmup + args.requests, days, args.clients,
+                     args.seed)
+    run(sportsball.app, drawn[:args.warmup], args.gzip, args.threads)
+    queue.join()
+
+    gc.collect()
+    gc.disable()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    wall, results = run(sportsball.app, drawn[args.warmup:], args.gzip,
+                        args.threads)
+    gc.enable()
+    print '%d requests in %.2fs, %d thread(s), mix %s\n' % (
+        len(results), wall, args.threads, args.mix)
+    report(wall, results)
+    queue.join()
+    server.stop()
+    bed.deactivate()
@@ -0,0 +1,71 @@
+#
+# in-process stand-in for the deferred task queue, for exercising
+# RefreshJob and Schedule.refresh_later without a task queue service:
+# deferred calls run on worker threads in this process, and named
+# tasks are de-duplicated the way the task queue does it.
+#
+#     queue = LocalQueue().install(schedule)
+#     ... /refresh ...
+#     queue.join()
+#
+import logging
+import threading
+from Queue import Queue
+from google.appengine.api import taskqueue
+
+class LocalQueue(object):
+    """
+    drop-in for google.appengine.ext.deferred as used by schedule.py:
+    defer(fn, *args, _name=None, **kwargs) runs fn(*args, **kwargs) on
+    one of workers daemon threads. A second task with the name of an
+    earlier one raises TaskAlreadyExistsError. names lists the names of
+    the tasks deferred, in order.
+
+    """
+    def __init__(self, workers=1):
+        self.names = []
+        self._tasks = Queue()
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def install(self, module):
+        """
+        have module's deferred.defer calls use this queue.
+
+        Returns: self
+        """
+        self._deferred = module.deferred
+        module.deferred = self
+        self._module = module
+        return self
+
+    def uninstall(self):
+        self._module.deferred = self._deferred
+
+    def defer(self, fn, *args, **kwargs):
+        name = kwargs.pop('_name', None)
+        for option in [k for k in kwargs if k.startswith('_')]:
+            del kwargs[option] # _countdown, _queue and the like
+        with self._lock:
+            if name is not None:
+                if name in self.names:
+                    raise taskqueue.TaskAlreadyExistsError(name)
+                self.names.append(name)
+        self._tasks.put((fn, args, kwargs))
+
+    def join(self):
+        """wait until every task deferred so far has run"""
+        self._tasks.join()
+
+    def _work(self):
+        while True:
+            fn, args, kwargs = self._tasks.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logging.exception("deferred task failed")
+            finally:
+                self._tasks.task_done()
@@ -0,0 +1,108 @@
+#
+# small in-process caches shared by the request handlers. Everything
+# here lives for the lifetime of an app instance, so every cache is
+# bounded and counts its hits and misses.
+#
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    a thread-safe mapping holding at most maxsize entries, evicting the
+    least recently used one when full. hits and misses count the outcomes
+    of get().
+
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        return the value cached for key, marking it most recently used,
+        or default if key isn't cached.
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        cache value for key, evicting least recently used entries if the
+        cache is over maxsize.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        """
+        Returns: dictionary of hits, misses, size and maxsize
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+class ByteLRUCache(LRUCache):
+    """
+    an LRUCache bounded by the total size of its values as well as by
+    their number. size(value) is the size of a value in bytes; a value
+    bigger than maxbytes is never cached.
+
+    """
+    def __init__(self, maxbytes, maxsize=1024, size=len):
+        LRUCache.__init__(self, maxsize)
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self._size = size
+
+    def put(self, key, value):
+        """
+        cache value for key, evicting least recently used entries until
+        the cache is within both maxsize and maxbytes.
+        """
+        size = self._size(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._size(self._entries.pop(key))
+            if size > self.maxbytes:
+                return
+            self._entries[key] = value
+            self.bytes += size
+            while (len(self._entries) > self.maxsize or
+                   self.bytes > self.maxbytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Returns: dictionary of hits, misses, size, maxsize, bytes and maxbytes
+        """
+        stats = LRUCache.stats(self)
+        stats.update(bytes=self.bytes, maxbytes=self.maxbytes)
+        return stats
@@ -8,7 +8,7 @@ from six.moves import filter, map, range
 
 from collections import namedtuple
 
-from .utils import get_lines
+from .parse import Container
 
 
 Extractor = namedtuple(
@@ -36,8 +36,22 @@ class Component(object):
         if container.name != self._TYPE:
             raise ValueError("container isn't an {}".format(self._TYPE))
 
+        # One pass over the container: the lines some extractor wants go
+        # to its bucket (last first, the order get_lines gave them in),
+        # the rest to _unused.
+        buckets = dict((extractor.type, []) for extractor in self._EXTRACTORS)
+        unused = Container(container.name)
+        for line in reversed(container):
+            bucket = buckets.get(line.name)
+            if bucket is None:
+                unused.append(line)
+            else:
+                bucket.append(line)
+        unused.reverse()
+
         for extractor in self._EXTRACTORS:
-            lines = get_lines(container, extractor.type)
+            # a second extractor of the same type finds nothing left
+            lines = buckets.pop(extractor.type, [])
             if not lines and extractor.required:
                 raise ValueError(
                     'A {} must have at least one {}'
@@ -56,7 +70,7 @@ class Component(object):
                 else:
                     extractor.function(self, None)  # Send None
 
-        self._unused = container  # Store unused lines
+        self._unused = unused  # Store unused lines
 
     @classmethod
     def _extracts(cls, line_type, required=False, multiple=False):
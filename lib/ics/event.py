@@ -36,6 +36,9 @@ class Event(Component):
 
     _TYPE = "VEVENT"
     _EXTRACTORS = []
+    # Bumped whenever the begin or end of any event is set, so that an
+    # EventList knows its interval index has gone stale.
+    _revision = 0
     _OUTPUTS = []
 
     def __init__(self,
@@ -63,6 +66,7 @@ class Event(Component):
             ValueError: if `end` and `duration` are specified at the same time
         """
 
+        self._pending = {}
         self._duration = None
         self._end_time = None
         self._begin = None
@@ -85,6 +89,21 @@ class Event(Component):
         elif duration:  # Duration was specified
             self.duration = duration
 
+    def __getattr__(self, attr):
+        """Decodes a property the extractors left pending, on first access.
+
+        Only called for attributes not set on the instance, which those \
+        are until then. The decoded value is set in their place.
+        """
+        pending = self.__dict__.get('_pending')
+        if not pending or attr not in pending:
+            raise AttributeError("'{}' object has no attribute '{}'"
+                                 .format(type(self).__name__, attr))
+        decode, line = pending[attr]
+        value = self.__dict__[attr] = decode(self, line)
+        pending.pop(attr, None)
+        return value
+
     def has_end(self):
         """
         Return:
@@ -110,6 +129,7 @@ class Event(Component):
             raise ValueError('Begin must be before end')
         self._begin = value
         self._begin_precision = 'second'
+        Event._revision += 1
 
     @property
     def end(self):
@@ -144,6 +164,7 @@ class Event(Component):
         self._end_time = value
         if value:
             self._duration = None
+        Event._revision += 1
 
     @property
     def duration(self):
@@ -175,6 +196,7 @@ class Event(Component):
             self._end_time = None
 
         self._duration = value
+        Event._revision += 1
 
     @property
     def all_day(self):
@@ -193,6 +215,7 @@ class Event(Component):
         self._begin = self._begin.floor('day')
         self._duration = None
         self._end_time = None
+        Event._revision += 1
 
     def __urepr__(self):
         """Should not be used directly. Use self.__repr__ instead.
@@ -272,6 +295,7 @@ class Event(Component):
             Event: an exact copy of self"""
         clone = copy.copy(self)
         clone._unused = clone._unused.clone()
+        clone._pending = dict(clone._pending)
         return clone
 
     def __hash__(self):
@@ -285,21 +309,46 @@ class Event(Component):
 ######################
 ####### Inputs #######
 
+# The extractors keep the lines of most properties as they are, for
+# Event.__getattr__ to decode the first time each one is read.
+
+def _pend(event, attr, decode, line):
+    """Leaves `line` for `decode(event, line)` to turn into `attr` of \
+    `event` when it is first read.
+    """
+    event.__dict__.pop(attr, None)  # so that reading it reaches __getattr__
+    event._pending[attr] = (decode, line)
+
+
+def _decode_time(event, line):
+    # get the dict of vtimezones passed to the classmethod
+    tz_dict = event._classmethod_kwargs['tz']
+    return iso_to_arrow(line, tz_dict)
+
+
+def _decode_precision(event, line):
+    return iso_precision(line.value)
+
+
+def _decode_duration(event, line):
+    return parse_duration(line.value)
+
+
+def _decode_text(event, line):
+    return unescape_string(line.value)
+
+
 @Event._extracts('DTSTAMP')
 def created(event, line):
     if line:
-        # get the dict of vtimezones passed to the classmethod
-        tz_dict = event._classmethod_kwargs['tz']
-        event.created = iso_to_arrow(line, tz_dict)
+        _pend(event, 'created', _decode_time, line)
 
 
 @Event._extracts('DTSTART')
 def start(event, line):
     if line:
-        # get the dict of vtimezones passed to the classmethod
-        tz_dict = event._classmethod_kwargs['tz']
-        event.begin = iso_to_arrow(line, tz_dict)
-        event._begin_precision = iso_precision(line.value)
+        _pend(event, '_begin', _decode_time, line)
+        _pend(event, '_begin_precision', _decode_precision, line)
 
 
 @Event._extracts('DURATION')
@@ -308,7 +357,7 @@ def duration(event, line):
         #TODO: DRY [1]
         if event._end_time: # pragma: no cover
             raise ValueError("An event can't have both DTEND and DURATION")
-        event._duration = parse_duration(line.value)
+        _pend(event, '_duration', _decode_duration, line)
 
 
 @Event._extracts('DTEND')
@@ -317,24 +366,31 @@ def end(event, line):
         #TODO: DRY [1]
         if event._duration:
             raise ValueError("An event can't have both DTEND and DURATION")
-        # get the dict of vtimezones passed to the classmethod
-        tz_dict = event._classmethod_kwargs['tz']
-        event._end_time = iso_to_arrow(line, tz_dict)
+        _pend(event, '_end_time', _decode_time, line)
 
 
 @Event._extracts('SUMMARY')
 def summary(event, line):
-    event.name = unescape_string(line.value) if line else None
+    if line:
+        _pend(event, 'name', _decode_text, line)
+    else:
+        event.name = None
 
 
 @Event._extracts('DESCRIPTION')
 def description(event, line):
-    event.description = unescape_string(line.value) if line else None
+    if line:
+        _pend(event, 'description', _decode_text, line)
+    else:
+        event.description = None
 
 
 @Event._extracts('LOCATION')
 def location(event, line):
-    event.location = unescape_string(line.value) if line else None
+    if line:
+        _pend(event, 'location', _decode_text, line)
+    else:
+        event.location = None
 
 
 # TODO : make uid required ?
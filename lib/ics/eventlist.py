@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals, absolute_import
+from bisect import bisect_left, bisect_right
+from datetime import datetime
 from collections import Iterable
 
 from six import PY2, PY3, StringIO, string_types, text_type, integer_types
@@ -14,6 +16,191 @@ from .utils import get_arrow
 from .event import Event
 
 
+def _condition(begin, end, step):
+    """Returns:
+        function: the test an event must pass to be in the slice \
+        [begin:end:step] of an :class:`ics.eventlist.EventList`
+    """
+    condition0 = lambda x: True
+
+    if begin:
+        condition_begin1 = lambda x: condition0(x) and x.begin > begin
+        condition_end1 = lambda x: condition0(x) and x.end > begin
+        if step == 'begin':
+            condition1 = condition_begin1
+        elif step == 'end':
+            condition1 = condition_end1
+        elif step == 'any':
+            condition1 = lambda x: condition_begin1(x) or \
+                condition_end1(x)
+        elif step == 'both':
+            condition1 = lambda x: condition_begin1(x) and \
+                condition_end1(x)
+    else:
+        condition1 = condition0
+
+    if step == 'inc':
+        return lambda x: x.begin < begin and end < x.end
+
+    if end:
+        condition_begin2 = lambda x: condition1(x) and x.begin < end
+        condition_end2 = lambda x: condition1(x) and x.end < end
+        if step == 'begin':
+            condition2 = condition_begin2
+        elif step == 'end':
+            condition2 = condition_end2
+        elif step == 'any':
+            condition2 = lambda x: condition_begin2(x) or \
+                condition_end2(x)
+        elif step == 'both':
+            condition2 = lambda x: condition_begin2(x) and \
+                condition_end2(x)
+    else:
+        condition2 = condition1
+
+    return condition2
+
+
+class _IntervalIndex(object):
+
+    """Sorted arrays over the events of an :class:`ics.eventlist.EventList`, \
+    answering its time-window queries in O(log n + m), m being the events \
+    in the range of an array that is scanned.
+
+    Events with both a begin and an end are indexed by position, with \
+    their begin and end as datetimes:
+
+        - `begins`, `by_begin`: begins in order and their positions,
+        - `ends`, `by_end`: the same for ends,
+        - `lows`, `by_low`: the earlier of begin and end in order, and \
+        `max_highs`, the latest of begin and end among the events up \
+        to each one, which never decreases: events sorted by low \
+        overlap a window from the first whose max_high passes its start \
+        to the last whose low precedes its end.
+
+    Other events (without a begin) are `loose`: queries test them one by \
+    one, as EventList always did.
+    """
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.revision = Event._revision
+        self.bounds = [None] * len(self.events)
+        self.loose = []
+        spans = []
+        for i, event in enumerate(self.events):
+            begin = event.begin
+            end = None if begin is None else event.end
+            if begin is None or end is None:
+                self.loose.append(i)
+            else:
+                begin, end = begin.datetime, end.datetime
+                self.bounds[i] = begin, end
+                spans.append((begin, end, i))
+
+        spans.sort(key=lambda span: (span[0], span[2]))
+        self.begins = [begin for begin, end, i in spans]
+        self.by_begin = [i for begin, end, i in spans]
+        spans.sort(key=lambda span: (span[1], span[2]))
+        self.ends = [end for begin, end, i in spans]
+        self.by_end = [i for begin, end, i in spans]
+        spans = sorted((min(begin, end), max(begin, end), i)
+                       for begin, end, i in spans)
+        self.lows = [low for low, high, i in spans]
+        self.by_low = [i for low, high, i in spans]
+        self.max_highs = []
+        for low, high, i in spans:
+            if self.max_highs and self.max_highs[-1] > high:
+                high = self.max_highs[-1]
+            self.max_highs.append(high)
+
+    def _range(self, keys, after, before):
+        """Returns:
+            tuple: the slice of `keys` (sorted) strictly after `after` \
+            and strictly before `before`, either of which may be None
+        """
+        lo = 0 if after is None else bisect_right(keys, after)
+        hi = len(keys) if before is None else bisect_left(keys, before)
+        return lo, hi
+
+    def _overlapping(self, after, before, inclusive=False):
+        """Returns:
+            list<int>: positions of the events with a high after `after` \
+            and a low before `before` (either may be None), a superset of \
+            those that overlap the window
+        """
+        if inclusive:
+            lo = 0 if after is None else bisect_left(self.max_highs, after)
+            hi = len(self.lows) if before is None else \
+                bisect_right(self.lows, before)
+        else:
+            lo = 0 if after is None else bisect_right(self.max_highs, after)
+            hi = len(self.lows) if before is None else \
+                bisect_left(self.lows, before)
+        return self.by_low[lo:hi]
+
+    def window(self, begin, end, step):
+        """Returns:
+            list<int>: the positions of the events in the slice \
+            [begin:end:step] (begin and end being Arrows or None), in order
+        """
+        b = begin.datetime if begin else None
+        e = end.datetime if end else None
+        bounds = self.bounds
+
+        if step == 'begin':
+            lo, hi = self._range(self.begins, b, e)
+            found = self.by_begin[lo:hi]
+        elif step == 'end':
+            lo, hi = self._range(self.ends, b, e)
+            found = self.by_end[lo:hi]
+        elif step == 'both':
+            # scan the narrower of the begin and end ranges
+            lo, hi = self._range(self.begins, b, e)
+            lo2, hi2 = self._range(self.ends, b, e)
+            if hi - lo <= hi2 - lo2:
+                found = [i for i in self.by_begin[lo:hi]
+                         if (b is None or bounds[i][1] > b) and
+                         (e is None or bounds[i][1] < e)]
+            else:
+                found = [i for i in self.by_end[lo2:hi2]
+                         if (b is None or bounds[i][0] > b) and
+                         (e is None or bounds[i][0] < e)]
+        elif step == 'any':
+            # begin or end after b, and begin or end before e
+            found = [i for i in self._overlapping(b, e)
+                     if (b is None or max(bounds[i]) > b)]
+        else:  # inc
+            found = [i for i in self._overlapping(e, b)
+                     if bounds[i][0] < b and e < bounds[i][1]]
+        return self._with_loose(found, _condition(begin, end, step))
+
+    def at(self, instant):
+        """Returns:
+            list<int>: the positions of the events going on at `instant` \
+            (a datetime), begin and end included, in order
+        """
+        bounds = self.bounds
+        found = [i for i in self._overlapping(instant, instant, True)
+                 if bounds[i][0] <= instant <= bounds[i][1]]
+        found.sort()
+        return found  # no loose event, without a begin, is going on
+
+    def _with_loose(self, found, condition):
+        """Returns:
+            list<int>: the positions in `found` and those of the loose \
+            events passing `condition`, in order
+        """
+        found.extend(i for i in self.loose if condition(self.events[i]))
+        found.sort()
+        return found
+
+    def get(self, positions):
+        """Returns:
+            list<Event>: the events at `positions`"""
+        return [self.events[i] for i in positions]
+
+
 class EventList(list):
 
     """EventList is a subclass of the standard :class:`list`.
@@ -31,14 +218,14 @@ class EventList(list):
         """
 
         super(EventList, self).__init__()
-        self.sort()
 
         for elem in arg:
             if not isinstance(elem, Event):
                 raise ValueError('EventList takes only iterables with elements of type "Event" not {}'
                     .format(type(elem)))
             else:
-                self.append(elem)
+                super(EventList, self).append(elem)
+        self.sort()  # Once, rather than after each element
 
     def __getitem__(self, sl):
         """Slices :class:`ics.eventlist.EventList`.
@@ -106,46 +293,10 @@ or None not '{}'".format(sl.step))
             step = sl.step
 
         begin, end = get_arrow(sl.start), get_arrow(sl.stop)
-        condition0 = lambda x: True
-
-        if begin:
-            condition_begin1 = lambda x: condition0(x) and x.begin > begin
-            condition_end1 = lambda x: condition0(x) and x.end > begin
-            if step == 'begin':
-                condition1 = condition_begin1
-            elif step == 'end':
-                condition1 = condition_end1
-            elif step == 'any':
-                condition1 = lambda x: condition_begin1(x) or \
-                    condition_end1(x)
-            elif step == 'both':
-                condition1 = lambda x: condition_begin1(x) and \
-                    condition_end1(x)
-        else:
-            condition1 = condition0
-
-        if end:
-            condition_begin2 = lambda x: condition1(x) and x.begin < end
-            condition_end2 = lambda x: condition1(x) and x.end < end
-            if step == 'begin':
-                condition2 = condition_begin2
-            elif step == 'end':
-                condition2 = condition_end2
-            elif step == 'any':
-                condition2 = lambda x: condition_begin2(x) or \
-                    condition_end2(x)
-            elif step == 'both':
-                condition2 = lambda x: condition_begin2(x) and \
-                    condition_end2(x)
-        else:
-            condition2 = condition1
-
-        if step == 'inc':
-            if not begin or not end:
-                return []
-            condition2 = lambda x: x.begin < begin and end < x.end
-
-        return list(filter(condition2, self))
+        if step == 'inc' and (not begin or not end):
+            return []
+        index = self._index()
+        return index.get(index.window(begin, end, step))
 
     def today(self, strict=False):
         """Args:
@@ -175,11 +326,7 @@ or None not '{}'".format(sl.step))
         Returns:
             list<Event>: all events that occurs now
         """
-        now = []
-        for event in self:
-            if event.begin <= arrow.now() <= event.end:
-                now.append(event)
-        return now
+        return self.at(arrow.now())
 
     def at(self, instant):
         """Args:
@@ -188,11 +335,12 @@ or None not '{}'".format(sl.step))
         Returns:
             list<Event>: all events that are occuring during `instant`.
         """
-        at = []
-        for event in self:
-            if event.begin <= instant <= event.end:
-                at.append(event)
-        return at
+        if isinstance(instant, Arrow):
+            instant = instant.datetime
+        elif not isinstance(instant, datetime):
+            instant = get_arrow(instant).datetime
+        index = self._index()
+        return index.get(index.at(instant))
 
     def concurrent(self, event):
         """Args:
@@ -200,10 +348,20 @@ or None not '{}'".format(sl.step))
         Returns:
             list<Event>: all events that are overlapping `event`
         """
-        a = self[event.begin:event.end:'any']
-        b = self[None:event.begin:'begin']
-        c = self[event.end:None:'end']
-        return list(set(a) | (set(b) & set(c)))
+        # Those overlapping it, and those that begin before it and end
+        # after it: each event (by uid) once, in list order
+        begin, end = event.begin, event.end
+        index = self._index()
+        found = set(index.window(begin, end, 'any'))
+        if begin and end:
+            found.update(index.window(begin, end, 'inc'))
+        seen = set()
+        concurrent = []
+        for elem in index.get(sorted(found)):
+            if elem not in seen:
+                seen.add(elem)
+                concurrent.append(elem)
+        return concurrent
 
     def _remove_duplicates(self):
         seen = set()
@@ -267,5 +425,75 @@ or None not '{}'".format(sl.step))
         if not isinstance(elem, Event):
             raise ValueError('EventList may only contain elements of type "Event" not {}'
                 .format(type(elem)))
-        super(EventList, self).append(elem)
+        # After any equal events, where sort() would have put it
+        self.insert(bisect_right(self, elem), elem)
+
+    def extend(self, iterable):
+        """Append the elements of `iterable` to self, keeping it sorted, and \
+        verifies that they are all :class:`ics.event.Event`.
+
+        The elements are appended and self sorted once. The sort finds \
+        self and sorted runs of `iterable` already in order and merges them.
+
+        Args:
+            iterable (iterable): elements to be appended
+        Raises:
+            ValueError: if an element is not a :class:`ics.event.Event`
+        """
+        acc = []
+        for elem in iterable:
+            if not isinstance(elem, Event):
+                raise ValueError('EventList may only contain elements of type "Event" not {}'
+                    .format(type(elem)))
+            acc.append(elem)
+        super(EventList, self).extend(acc)
         self.sort()
+
+    def __iadd__(self, iterable):
+        self.extend(iterable)
+        return self
+
+    def _index(self):
+        """Returns:
+            _IntervalIndex: the index of self's events, built anew if self \
+            or the begin or end of any event has changed since it was built
+        """
+        index = getattr(self, '_interval_index', None)
+        if index is None or index.revision != Event._revision:
+            index = self._interval_index = _IntervalIndex(self)
+        return index
+
+    # Whatever changes self drops its index. (__setitem__, append, extend
+    # and += go through sort or insert.)
+
+    def sort(self, *args, **kwargs):
+        super(EventList, self).sort(*args, **kwargs)
+        self._interval_index = None
+
+    def reverse(self):
+        super(EventList, self).reverse()
+        self._interval_index = None
+
+    def insert(self, i, elem):
+        super(EventList, self).insert(i, elem)
+        self._interval_index = None
+
+    def remove(self, elem):
+        super(EventList, self).remove(elem)
+        self._interval_index = None
+
+    def pop(self, *args):
+        self._interval_index = None
+        return super(EventList, self).pop(*args)
+
+    def __delitem__(self, key):
+        super(EventList, self).__delitem__(key)
+        self._interval_index = None
+
+    def __delslice__(self, i, j):
+        """Compatibility for python2"""
+        return self.__delitem__(slice(i, j))
+
+    def __imul__(self, n):
+        self._interval_index = None
+        return super(EventList, self).__imul__(n)
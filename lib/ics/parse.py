@@ -6,12 +6,56 @@ from six import PY2, PY3
 from six.moves import filter, map, range
 
 import collections
+import re
 
 
 class ParseError(Exception):
     pass
 
 
+# A content line's parameters (RFC 5545 3.1), each matched where the
+# last one ended: a parameter name, its '=' and its first value, then
+# any more values after a ','. A value is either quoted (so it may
+# contain ':', ';' and ',') or not.
+_PARAM = re.compile('([^=;:]*)=(?:"([^"]*)"|([^;:,]*))')
+_PARAM_VALUE = re.compile(',(?:"([^"]*)"|([^;:,]*))')
+_UNSAFE = re.compile('[;:,]')
+
+
+def scan_line(line):
+    """Splits a content line into its name, params and value in one
+    pass, honouring quoted parameter values.
+
+    Return:
+        tuple: (name, {param name: [param values]}, value)
+    """
+    colon = line.find(':')
+    if colon < 0:
+        raise ParseError("No ':' in line '{}'".format(line))
+    i = line.find(';', 0, colon)
+    if i < 0: # no params, so no quotes: the name ends at the first ':'
+        return line[:colon], {}, line[colon + 1:].strip()
+    name, params, end = line[:i], {}, len(line)
+    while line[i] == ';':
+        match = _PARAM.match(line, i + 1)
+        if match is None:
+            raise ParseError("No '=' in line '{}'".format(line))
+        pname, quoted, value = match.groups()
+        values = params[pname] = [value if quoted is None else quoted]
+        i = match.end()
+        while i < end and line[i] == ',':
+            match = _PARAM_VALUE.match(line, i)
+            quoted, value = match.groups()
+            values.append(value if quoted is None else quoted)
+            i = match.end()
+        if i == end:
+            raise ParseError("No ':' in line '{}'".format(line))
+    if line[i] != ':':
+        raise ParseError("Unexpected '{}' at column {} of line '{}'".format(
+            line[i], i, line))
+    return name, params, line[i + 1:].strip()
+
+
 class ContentLine:
 
     def __eq__(self, other):
@@ -30,7 +74,9 @@ class ContentLine:
     def __str__(self):
         params_str = ''
         for pname in self.params:
-            params_str += ';{}={}'.format(pname, ','.join(self.params[pname]))
+            params_str += ';{}={}'.format(pname, ','.join(
+                '"{}"'.format(pval) if _UNSAFE.search(pval) else pval
+                for pval in self.params[pname]))
         ret = "{}{}:{}".format(self.name, params_str, self.value)
         return ret.encode('utf-8') if PY2 else ret
 
@@ -51,25 +97,7 @@ class ContentLine:
 
     @classmethod
     def parse(cls, line):
-        if ':' not in line:
-            raise ParseError("No ':' in line '{}'".format(line))
-
-        # Separe key and value
-        splitted = line.split(':')
-        key, value = splitted[0], ':'.join(splitted[1:]).strip()
-
-        # Separe name and params
-        splitted = key.split(';')
-        name, params_strings = splitted[0], splitted[1:]
-
-        # Separe key and values for params
-        params = {}
-        for paramstr in params_strings:
-            if '=' not in paramstr:
-                raise ParseError("No '=' in line '{}'".format(line))
-            splitted = paramstr.split('=')
-            pname, pvals = splitted[0], '='.join(splitted[1:])
-            params[pname] = pvals.split(',')
+        name, params, value = scan_line(line)
         return cls(name, params, value)
 
     def clone(self):
@@ -0,0 +1,169 @@
+#
+# request timing: spans around the stages of handling a request (the
+# datastore, decoding, answers, rendering...), summed per request and
+# aggregated per route into histograms, which export() renders in the
+# Prometheus text format. With SPORTSBALL_METRICS=off in the environment
+# span() hands back a shared do-nothing span and Instrumented passes
+# requests straight through. The export is served only to scrapers that
+# send SPORTSBALL_METRICS_TOKEN from the environment as a bearer token.
+#
+import os
+import threading
+from bisect import bisect_left
+try:
+    from time import monotonic
+except ImportError:
+    try:
+        from monotonic import monotonic # optional backport for python 2
+    except ImportError:
+        from time import time as monotonic
+
+enabled = os.environ.get('SPORTSBALL_METRICS', 'on') != 'off'
+token = os.environ.get('SPORTSBALL_METRICS_TOKEN') # None: no export
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+
+_histograms = {} # Histogram by (metric name, label values)
+_collectors = [] # functions returning more metrics for export
+_lock = threading.Lock()
+_request = threading.local() # route and stage timings of this request
+
+class Histogram(object):
+    """counts of observations by BUCKETS bucket, with their sum"""
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+def observe(metric, labels, seconds):
+    """add seconds to the histogram for metric and labels (a tuple)"""
+    with _lock:
+        histogram = _histograms.get((metric, labels))
+        if histogram is None:
+            histogram = _histograms[(metric, labels)] = Histogram()
+        histogram.observe(seconds)
+
+class Span(object):
+    """times a with block as a stage of the current request"""
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = monotonic()
+
+    def __exit__(self, *exc_info):
+        seconds = monotonic() - self.start
+        stages = getattr(_request, 'stages', None)
+        if stages is None: # not in a request, eg a task
+            observe('stage', ('background', self.stage), seconds)
+        else:
+            stages[self.stage] = stages.get(self.stage, 0.0) + seconds
+
+class NoSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NO_SPAN = NoSpan()
+
+def span(stage):
+    """
+    Returns: context manager timing its block as stage of this request
+    """
+    return Span(stage) if enabled else NO_SPAN
+
+def set_route(route):
+    """name the route handling this thread's request, for its metrics"""
+    if enabled:
+        _request.route = route
+
+def collector(fn):
+    """
+    have export() include the metrics fn() returns: a list of (name,
+    type, help, samples), samples being a list of (labels dictionary,
+    value)
+    """
+    _collectors.append(fn)
+
+class Instrumented(object):
+    """
+    WSGI middleware timing each request to app, and the spans in it,
+    into histograms by the route set_route names ('unrouted' if none:
+    a request turned away by the router, say).
+
+    """
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if not enabled:
+            return self.app(environ, start_response)
+        _request.route, _request.stages = None, {}
+        start = monotonic()
+        try:
+            return self.app(environ, start_response)
+        finally:
+            seconds = monotonic() - start
+            route = _request.route or 'unrouted'
+            observe('request', (route,), seconds)
+            for stage, seconds in _request.stages.items():
+                observe('stage', (route, stage), seconds)
+            _request.route, _request.stages = None, None
+
+HISTOGRAMS = (
+    ('request', ('route',), 'sportsball_request_seconds',
+     'Time spent handling requests, by route.'),
+    ('stage', ('route', 'stage'), 'sportsball_stage_seconds',
+     'Time spent in each stage of handling requests, by route.'),
+)
+
+def labelled(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join(
+            '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace(
+                    '"', '\\"').replace('\n', '\\n'))
+            for key, value in sorted(labels.items())))
+
+def export():
+    """
+    Returns: every metric in the Prometheus text exposition format
+    """
+    with _lock:
+        histograms = sorted((key, list(h.counts), h.sum)
+                            for key, h in _histograms.items())
+    lines = []
+    for metric, label_names, name, help in HISTOGRAMS:
+        lines += ['# HELP %s %s' % (name, help), '# TYPE %s histogram' % name]
+        for (kind, values), counts, total in histograms:
+            if kind != metric:
+                continue
+            labels = dict(zip(label_names, values))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s %d' % (labelled(name + '_bucket', dict(
+                                labels, le=bound)), cumulative))
+            lines.append('%s %r' % (labelled(name + '_sum', labels), total))
+            lines.append('%s %d' % (labelled(name + '_count', labels),
+                                    cumulative))
+    for fn in _collectors:
+        for name, kind, help, samples in fn():
+            lines += ['# HELP %s %s' % (name, help),
+                      '# TYPE %s %s' % (name, kind)]
+            lines += ['%s %r' % (labelled(name, labels), float(value))
+                      for labels, value in samples]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,118 @@
+#
+# WSGI middleware caching whole responses in this app instance. The
+# wrapped app's pages are pure functions of the request path and query,
+# the schedule version and the Pacific date, so a response can be
+# replayed for any later request that maps to the same key without
+# calling the app at all.
+#
+import time
+from cache import ByteLRUCache
+from metrics import set_route
+
+class MicroCache(object):
+    """
+    WSGI middleware replaying cached 200 responses of app. key(environ)
+    names the response a request would get, or is None if the request
+    mustn't be answered from the cache. Cached responses are held in a
+    ByteLRUCache of at most maxbytes of body.
+
+    Replayed responses carry an Age header, so clients and caches
+    downstream count their max-age from when the response was made. A
+    request whose If-None-Match matches the cached ETag gets a 304.
+    Requests with only If-Modified-Since go to the app.
+
+    """
+    def __init__(self, app, key, maxbytes=(4 << 20), maxsize=1024):
+        self.app = app
+        self.key = key
+        self.responses = ByteLRUCache(maxbytes, maxsize,
+                                      size=lambda response: len(response[2]))
+
+    def clear(self, *args):
+        """drop every cached response. Ignores args, to serve as a listener"""
+        self.responses.clear()
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'GET' or (
+            'HTTP_IF_MODIFIED_SINCE' in environ and
+            'HTTP_IF_NONE_MATCH' not in environ):
+            return self.app(environ, start_response)
+        key = self.key(environ)
+        if key is None:
+            return self.app(environ, start_response)
+        response = self.responses.get(key)
+        if response is not None:
+            set_route('MicroCache')
+        else:
+            response = self.capture(environ)
+            status, headers, body, made = response
+            if status[:3] != '200' or self.uncacheable(headers):
+                start_response(status, headers)
+                return [body]
+            self.responses.put(key, response)
+        return self.replay(response, start_response,
+                           not_modified=self.etag_matches(environ, response[1]))
+
+    def capture(self, environ):
+        """
+        run the app for environ, collecting its response.
+
+        Returns: (status, headers, body, time made)
+        """
+        captured = []
+        def start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers]
+            return lambda data: chunks.append(data)
+        chunks = []
+        result = self.app(environ, start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return captured[0], captured[1], ''.join(chunks), time.time()
+
+    @staticmethod
+    def uncacheable(headers):
+        """whether headers rule out replaying the response to others"""
+        for name, value in headers:
+            name = name.lower()
+            if name == 'set-cookie' or (name == 'cache-control' and
+                                        ('private' in value or
+                                         'no-cache' in value or
+                                         'no-store' in value)):
+                return True
+        return False
+
+    @staticmethod
+    def etag_matches(environ, headers):
+        """
+        whether the request's If-None-Match matches the ETag in headers.
+        That is the ETag of the one content-coding cached under the key,
+        suffix and all (see CachedPage.send), so it is matched exactly.
+        """
+        etag = dict((name.lower(), value) for name, value in headers).get('etag')
+        if etag is None or 'HTTP_IF_NONE_MATCH' not in environ:
+            return False
+        etags = [t.strip() for t in environ['HTTP_IF_NONE_MATCH'].split(',')]
+        return '*' in etags or etag in [
+            t[2:] if t.startswith('W/') else t for t in etags]
+
+    @staticmethod
+    def replay(response, start_response, not_modified=False):
+        """
+        start a cached response, or a 304 with its headers, aged by the
+        time since it was made.
+
+        Returns: the response body iterable
+        """
+        status, headers, body, made = response
+        age = ('Age', str(int(time.time() - made)))
+        if not_modified:
+            headers = [(name, value) for name, value in headers
+                       if name.lower() not in ('content-length', 'content-type',
+                                               'content-encoding')]
+            start_response('304 Not Modified', headers + [age])
+            return []
+        start_response(status, headers + [age])
+        return [body]
@@ -4,15 +4,85 @@
 #
 import logging
 import json
-from datetime import datetime, timedelta, date
+import time
+import threading
+from hashlib import md5, sha1
+from uuid import uuid4
+from bisect import bisect_left
+from itertools import izip
+from array import array
+import struct
+from operator import itemgetter
+from collections import namedtuple
+from Queue import Queue, Empty
+from StringIO import StringIO
+from datetime import datetime, timedelta, date, time as clock_time
 from pytz import timezone, utc
-from google.appengine.ext import db
-from ics import Calendar
-from urllib2 import urlopen
+from google.appengine.api import taskqueue
+from google.appengine.ext import db, deferred
+from dateutil.tz import tzical
+from ics.parse import ContentLine, scan_line, unfold_lines
+from ics.utils import iso_to_arrow, unescape_string
+from urllib2 import urlopen, Request, HTTPError
+from cache import LRUCache
+from metrics import span
 
 # This iCal URL will be updated throughout the season as schedules change
 SCHED_URL = 'http://www.ticketing-client.com/ticketing-client/ical/EventTicketPromotionPrice.tiksrv?team_id=137&display_in=singlegame&ticket_category=Tickets&site_section=Default&sub_category=Default&leave_empty_games=true&event_type=T&begin_date=20190201'
 
+# A schedule feed we keep a Schedule for. team is how the feed's event
+# summaries name its home side ("Dodgers vs. Giants"), and games at a
+# location starting with venue are the ones "here".
+Feed = namedtuple('Feed', ['name', 'url', 'team', 'venue'])
+
+# registry of feeds, by name (see register_feed)
+FEEDS = {}
+
+# seconds allowed for fetching and parsing one feed
+FEED_TIMEOUT = 20
+
+# most feeds refresh_all fetches at once
+REFRESH_WORKERS = 8
+
+# seconds a RefreshLease outlasts its refresh's feed timeout, and seconds
+# between checks by a refresh waiting for another to release one
+LEASE_MARGIN = 30
+LEASE_POLL = 1
+
+# seconds an app instance serves its cached Schedule before checking the
+# datastore for a newer version
+CACHE_SECS = 60
+
+# RefreshJob states, and seconds after which a job that hasn't finished
+# is taken to have died. Jobs are named for their url and JOB_PERIOD, so
+# there is at most one new job per feed per JOB_PERIOD seconds. Jobs are
+# deleted JOB_KEEP seconds after they were created (see RefreshJob.prune).
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+JOB_TIMEOUT = 600
+JOB_PERIOD = 10
+JOB_KEEP = 24 * 3600
+
+# the answer for any date after the last game here
+NO_MORE_GAMES = [False, 'No more home games!', "(...until next year...)"]
+
+# the only VEVENT properties get_feed needs
+GAME_PROPERTIES = ('SUMMARY', 'LOCATION', 'DTSTART')
+
+# get_feed's result when the feed hasn't changed since the last fetch
+UNCHANGED = 'unchanged'
+
+# binary encoding of the stored schedule, see ScheduleEvents.encode:
+# header (magic, version, string count, event count), string length
+# prefix, and event record (day ordinal, minute of day, opponent and
+# location string positions, flag bits)
+ENCODING_MAGIC = 'SBSE'
+ENCODING_VERSION = 1
+ENCODING_HEADER = struct.Struct('>4sBHH')
+ENCODING_LENGTH = struct.Struct('>H')
+ENCODING_EVENT = 'iHHHB'
+IS_HOME = 1
+IS_HERE = 2
+
 # for sanity, all date/time storage and manipulations will be in
 # Oracle Park's local TZ
 ORACLE_TZ = timezone('US/Pacific')
@@ -32,143 +102,1162 @@ def oraclenow():
 
     return localize(datetime.now(utc))
 
+def clock_minutes(clock):
+    """
+    minutes since midnight of a "%I:%M %p" time such as '07:15 PM'
+    """
+    hour = int(clock[:2]) % 12 + (12 if clock[6:8].upper() == 'PM' else 0)
+    return hour * 60 + int(clock[3:5])
+
+def register_feed(name, url, team='Giants', venue='Oracle'):
+    """
+    add a feed to FEEDS, replacing any feed of the same name.
+
+    Returns: the Feed
+    """
+    feed = FEEDS[name] = Feed(name, url, team, venue)
+    return feed
+
+def feed_for(url):
+    """
+    Returns: the registered Feed for url, or a Giants feed at Oracle
+    Park for urls that aren't registered
+    """
+    for feed in FEEDS.values():
+        if feed.url == url:
+            return feed
+    return Feed(url, url, 'Giants', 'Oracle')
+
+register_feed('giants', SCHED_URL)
+
+def isodate_ordinal(iso):
+    """
+    proleptic Gregorian day ordinal of a YYYY-MM-DD string, without the
+    overhead of strptime. Raises ValueError if iso is malformed.
+    """
+    if len(iso) != 10 or iso[4] != '-' or iso[7] != '-':
+        raise ValueError("malformed isodate '%s'" % iso)
+    return date(int(iso[:4]), int(iso[5:7]), int(iso[8:])).toordinal()
+
+class DayIndex(object):
+    """
+    day-ordinal index over the date-sorted events of a ScheduleEvents,
+    built once per schedule version so that "next game here" and "next
+    quiet day" are array lookups rather than scans of the events.
+
+    here_dates/here_events hold the date and position of the first
+    event here on each day with a game here, in date order. next_here
+    and next_quiet have one slot per day from the first to the last day
+    with a game here: the position in here_events of the next game here
+    on or after that day, and the ordinal of the next day on or after it
+    with no game here.
+    """
+    def __init__(self, days, flags):
+        self.here_dates = []
+        self.here_events = []
+        here_days = []
+        for i, day in enumerate(days):
+            if flags[i] & IS_HERE and (not here_days or here_days[-1] != day):
+                self.here_dates.append(date.fromordinal(day).isoformat())
+                self.here_events.append(i)
+                here_days.append(day)
+        self.first = here_days[0] if here_days else 0
+        ndays = here_days[-1] - self.first + 1 if here_days else 0
+        self.next_here = [0] * ndays
+        self.next_quiet = [0] * ndays
+        pos, quiet = len(here_days), self.first + ndays
+        for offset in reversed(range(ndays)):
+            day = self.first + offset
+            if pos and here_days[pos - 1] == day:
+                pos -= 1
+            else:
+                quiet = day
+            self.next_here[offset] = pos
+            self.next_quiet[offset] = quiet
+
+    def next_here_event(self, isodate):
+        """
+        the position of the first event here on or after isodate, or None.
+        """
+        try:
+            offset = isodate_ordinal(isodate) - self.first
+        except ValueError:
+            # not a real date, so fall back on comparing isodate strings
+            pos = bisect_left(self.here_dates, isodate)
+        else:
+            if offset < 0:
+                pos = 0
+            elif offset < len(self.next_here):
+                pos = self.next_here[offset]
+            else:
+                return None
+        return self.here_events[pos] if pos < len(self.here_events) else None
+
+    def next_quiet_ordinal(self, isodate):
+        """
+        day ordinal of the first day on or after isodate with no game here.
+        """
+        day = isodate_ordinal(isodate)
+        offset = day - self.first
+        if 0 <= offset < len(self.next_quiet):
+            return self.next_quiet[offset]
+        return day
+
+class ScheduleEvents(object):
+    """
+    the events of one version of a schedule, decoded once into compact
+    parallel columns sorted by date: day ordinals and minutes of the day
+    (arrays), opponents and locations (positions in the strings table),
+    and IS_HOME/IS_HERE flag bits. event() builds the event dictionary
+    for a position; encode() and decode() convert to and from the
+    stored binary form. team names the home side in answers.
+
+    """
+    def __init__(self, days, minutes, them, locations, flags, strings,
+                 team='Giants'):
+        self.days = days
+        self.minutes = minutes
+        self.them = them
+        self.locations = locations
+        self.flags = flags
+        self.strings = strings
+        self.team = team
+        self.index = DayIndex(days, flags)
+        self._json = None
+
+    @classmethod
+    def from_dicts(cls, events, team='Giants'):
+        """
+        Returns: ScheduleEvents for a list of event dictionaries, as made
+        by feed_event or stored as json by older versions of this app
+        """
+        events = sorted(events, key=itemgetter('date'))
+        strings, interned = [], {}
+        def intern(s):
+            if s not in interned:
+                interned[s] = len(strings)
+                strings.append(s)
+            return interned[s]
+        return cls(array('i', [isodate_ordinal(e['date']) for e in events]),
+                   array('H', [clock_minutes(e['time']) for e in events]),
+                   array('H', [intern(e['them']) for e in events]),
+                   array('H', [intern(e['location']) for e in events]),
+                   array('B', [(e['is_home'] and IS_HOME) |
+                               (e['is_here'] and IS_HERE) for e in events]),
+                   strings, team)
+
+    @classmethod
+    def decode(cls, data, team='Giants'):
+        """
+        Returns: ScheduleEvents for the binary form made by encode()
+        """
+        magic, version, nstrings, nevents = ENCODING_HEADER.unpack_from(data)
+        if magic != ENCODING_MAGIC or version != ENCODING_VERSION:
+            raise ValueError("unknown schedule encoding %r %r" % (magic, version))
+        offset = ENCODING_HEADER.size
+        strings = []
+        for _ in xrange(nstrings):
+            length, = ENCODING_LENGTH.unpack_from(data, offset)
+            offset += ENCODING_LENGTH.size
+            strings.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        fields = struct.unpack_from('>' + ENCODING_EVENT * nevents, data, offset)
+        width = len(ENCODING_EVENT)
+        return cls(array('i', fields[0::width]), array('H', fields[1::width]),
+                   array('H', fields[2::width]), array('H', fields[3::width]),
+                   array('B', fields[4::width]), strings, team)
+
+    def encode(self):
+        """
+        the versioned binary form of these events: a header of magic,
+        format version, string and event counts, then each string as a
+        length-prefixed utf-8 string, then fixed-width event records.
+
+        Returns: byte string
+        """
+        parts = [ENCODING_HEADER.pack(ENCODING_MAGIC, ENCODING_VERSION,
+                                      len(self.strings), len(self))]
+        for s in self.strings:
+            s = s.encode('utf-8')
+            parts.append(ENCODING_LENGTH.pack(len(s)))
+            parts.append(s)
+        columns = (self.days, self.minutes, self.them, self.locations,
+                   self.flags)
+        parts.append(struct.pack('>' + ENCODING_EVENT * len(self),
+                                 *[f for event in izip(*columns) for f in event]))
+        return ''.join(parts)
+
+    def __len__(self):
+        return len(self.days)
+
+    def event(self, i):
+        """
+        Returns: the event dictionary for the event at position i
+        """
+        day, minute = date.fromordinal(self.days[i]), self.minutes[i]
+        return {
+            'date': day.isoformat(),
+            'day': day.strftime("%A, %b %d"),
+            'time': clock_time(minute // 60, minute % 60).strftime("%I:%M %p"),
+            'is_home': bool(self.flags[i] & IS_HOME),
+            'is_here': bool(self.flags[i] & IS_HERE),
+            'location': self.strings[self.locations[i]],
+            'them': self.strings[self.them[i]]
+        }
+
+    def keyed(self):
+        """
+        the events with ids that are stable across versions of a schedule
+        for as long as the game keeps its day: the isodate, and the
+        event's position among that day's events ('2019-04-05#0').
+
+        Returns: list of event dictionaries with their 'id', in date order
+        """
+        events, day, n = [], None, 0
+        for i in xrange(len(self)):
+            n = n + 1 if self.days[i] == day else 0
+            day = self.days[i]
+            event = self.event(i)
+            event['id'] = '%s#%d' % (event['date'], n)
+            events.append(event)
+        return events
+
+    def to_json(self):
+        """
+        Returns: the events as a json list of event dictionaries, built
+        once and then cached
+        """
+        if self._json is None:
+            self._json = json.dumps([self.event(i) for i in xrange(len(self))])
+        return self._json
+
+    def answer(self, isodate):
+        """
+        the site's answer for isodate: whether there is a game here that
+        day, and two lines of message about it.
+
+        Returns: [is_home, today message, tomorrow message]
+        """
+        pos = self.index.next_here_event(isodate)
+        if pos is None:
+            return NO_MORE_GAMES
+        e = self.event(pos)
+        if e['date'] != isodate:
+            return [False, 'No home game today!',
+                    'All quiet until %s, when %s play %s at %s' % (
+                        e['day'], self.team, e['them'], e['time'])]
+        else:
+            quiet = date.fromordinal(self.index.next_quiet_ordinal(isodate))
+            return [True, '%s play %s at %s\n' % (
+                        self.team, e['them'], e['time']),
+                    "No peace and quiet until %s" % quiet.strftime("%A, %b %d")]
+
+    def answer_table(self, first_isodate):
+        """
+        precompute answer() for every day from first_isodate through the
+        last game here.
+
+        Returns: dictionary of answers by isodate ('days'), the first and
+        last isodates covered, and the answer for every day after 'last'.
+        """
+        last = self.index.here_dates[-1] if self.index.here_dates else ''
+        days = {}
+        day, isodate = isodate_ordinal(first_isodate), first_isodate
+        while isodate <= last:
+            days[isodate] = self.answer(isodate)
+            day += 1
+            isodate = date.fromordinal(day).isoformat()
+        return {'first': first_isodate, 'last': last, 'days': days,
+                'after': NO_MORE_GAMES}
+
 class Schedule(db.Model):
     """
     Factory for schedule instances backed by entities in the datastore.
     Don't instantiate this class -- use Schedule.get() to retrieve an
-    instance by url.
+    instance by url. Entities are keyed by key_name_for(url), so they can
+    be read by key and updated in a transaction.
 
     """
-    url =  db.StringProperty() # feed url, also used as primary key
-    json = db.TextProperty()
-    timestamp = db.DateTimeProperty(auto_now=True)
-    _events = {} # event lists cached by isodate
+    url =  db.StringProperty() # feed url, whose md5 is the key name
+    data = db.BlobProperty() # ScheduleEvents.encode() of the events
+    json = db.TextProperty() # events as stored before data, read if no data
+    answers = db.TextProperty() # json answer_table from the last refresh
+    etag = db.StringProperty(indexed=False) # validators from the last
+    last_modified = db.StringProperty(indexed=False) # fetch of the feed,
+    content_hash = db.StringProperty(indexed=False) # see get_feed
+    timestamp = db.DateTimeProperty() # set by refresh, versions the schedule
+    version = db.IntegerProperty(indexed=False) # counts refreshes that stored
+    _cache = {} # (Schedule, time last checked) for this app instance, by url
+    _decoded = LRUCache(maxsize=16) # ScheduleEvents by (url, timestamp)
+    _answer_tables = LRUCache(maxsize=16) # answer tables by (url, timestamp)
+    _refreshing = {} # refresh period last enqueued by this app instance, by url
+    _locks = {} # threading.Lock serializing synchronous refreshes, by url
+    _listeners = [] # called with the url after refresh stores a new version
+    _changes = LRUCache(maxsize=64) # get_changes results, by url, version, since
 
     @classmethod
-    def get(cls, url=SCHED_URL, every_secs=(24 * 3600)):
+    def get(cls, url=SCHED_URL, every_secs=(24 * 3600), max_age=CACHE_SECS):
         """
-        fetch the cached schedule for this url from the datastore. If it
-        does not exist, or is over every_secs seconds old, refresh it from the
-        url feed before returning.
+        fetch the cached schedule for this url from the datastore, checking
+        it is current if this instance looked over max_age seconds ago (see
+        cached). If it does not exist, refresh it from the url feed before
+        returning. If it is over every_secs seconds old, return it anyway
+        and refresh it in the background (see refresh_later).
 
         Returns: Schedule instance for the url
 
         """
-        sched = cls.all().filter("url ==", url).get()
-        if (not sched or not sched.json or
-            sched.timestamp < datetime.now() - timedelta(seconds=every_secs)):
-            sched = cls.refresh(url=url)
+        sched = cls.cached(url, max_age)
+        if not sched or not sched.has_events():
+            sched = cls.refresh_now(url)
+        elif sched.timestamp < datetime.now() - timedelta(seconds=every_secs):
+            cls.refresh_later(url, every_secs)
         if not sched:
-            logging.error("cannot fetch sched.json from DataStore")
+            logging.error("cannot fetch schedule from DataStore")
             return None
         return sched
 
     @classmethod
-    def refresh(cls, url=SCHED_URL):
+    def cached(cls, url=SCHED_URL, max_age=CACHE_SECS):
+        """
+        return this app instance's cached Schedule for url. The datastore
+        is consulted at most once every max_age seconds, and then only for
+        the stored timestamp; the full entity is re-read only when that
+        timestamp differs from the cached version.
+
+        Returns: Schedule instance for the url, or None if there is none
+
+        """
+        now = time.time()
+        sched, checked = cls._cache.get(url, (None, 0))
+        if sched and now - checked < max_age:
+            return sched
+        if sched:
+            key = db.Key.from_path(cls.kind(), cls.key_name_for(url))
+            with span('datastore'):
+                stored = db.Query(cls, projection=('timestamp',)).filter(
+                    "__key__ =", key).get()
+            if stored and stored.timestamp == sched.timestamp:
+                cls._cache[url] = (sched, now)
+                return sched
+        sched = cls.lookup(url)
+        if sched:
+            cls._cache[url] = (sched, now)
+        else:
+            cls._cache.pop(url, None)
+        return sched
+
+    @staticmethod
+    def key_name_for(url):
+        return md5(url).hexdigest()
+
+    @classmethod
+    def lookup(cls, url=SCHED_URL):
+        """
+        read the stored Schedule for url by its key, which unlike a query
+        sees the latest refresh. A schedule stored before they were keyed
+        by url is found by a query instead, until refresh replaces it.
+
+        Returns: Schedule instance for the url, or None if there is none
+
+        """
+        with span('datastore'):
+            sched = cls.get_by_key_name(cls.key_name_for(url))
+            if sched is None:
+                sched = cls.all().filter("url ==", url).get()
+        return sched
+
+    @classmethod
+    def refresh_now(cls, url=SCHED_URL):
         """
-        update our schedule.json from the feed url and store it in
+        refresh the schedule for url in this request, for when there is no
+        stored schedule to serve in the meantime. Concurrent callers for
+        the same url wait for a single refresh rather than each fetching
+        the feed.
+
+        Returns: Schedule instance for the url, or None
+
+        """
+        with cls._locks.setdefault(url, threading.Lock()):
+            sched = cls.cached(url)
+            if sched and sched.has_events():
+                return sched # another thread refreshed while we waited
+            return cls.refresh(url=url)
+
+    @classmethod
+    def refresh_later(cls, url=SCHED_URL, every_secs=(24 * 3600)):
+        """
+        enqueue a task to refresh the schedule for url, off the request
+        path. There is at most one such task per url per every_secs
+        period: tasks are named for the url and period, so the task queue
+        rejects duplicates from other app instances, and this instance
+        doesn't try again once it has enqueued one.
+
+        """
+        period = int(time.time()) // every_secs
+        if cls._refreshing.get(url) == period:
+            return
+        cls._refreshing[url] = period
+        name = 'refresh-%s-%d-%d' % (md5(url).hexdigest(), every_secs, period)
+        try:
+            deferred.defer(refresh_task, url, every_secs, _name=name)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass # another instance got there first
+        except taskqueue.Error, e:
+            logging.error("can't enqueue schedule refresh: " + str(e))
+            cls._refreshing.pop(url, None)
+
+    @classmethod
+    def refresh(cls, url=SCHED_URL, timeout=FEED_TIMEOUT, timings=None):
+        """
+        update our schedule from the feed url and store it in
         DataStore, creating a persistent Schedule object if necessary.
+        If the feed is unchanged since the last refresh, nothing is parsed
+        and the schedule keeps its timestamp; only new validators for an
+        unchanged body are stored. The fetch is
+        abandoned after timeout seconds. If timings is a dictionary, the
+        seconds spent fetching and parsing the feed ('fetch'), building
+        the answers ('build') and storing them ('store') are added to it.
+
+        Only one refresh of a url runs at a time, wherever it was started
+        (a request, a RefreshJob, refresh_task or refresh_all): it holds
+        the url's RefreshLease, and any other waits for it to finish and
+        returns the schedule then stored, with the seconds it waited added
+        to timings as 'wait'. Should a lease expire with its refresh still
+        running, the new version is stored in a transaction (see _store),
+        so two overlapping refreshes store two versions, or one if they
+        fetched the same feed, each with its own ScheduleChange.
 
-        Returns: Schedule instance with refreshed schedule json.
+        Returns: Schedule instance with refreshed schedule, or None
+        if the feed couldn't be fetched or had no events (in which case
+        the stored schedule is left alone).
 
         """
-        sched = cls.all().filter("url ==", url).get()
-        if not sched:
-            sched = cls()
-            sched.url = url
-            sched.json = None
-            sched._events = {} # cache for parsed events, not persisted.
-        events = get_feed(url)
-        if events:
-            sched.json = json.dumps(events)
-            sched._events = {}
-        sched.put()
+        if timings is None:
+            timings = {}
+        holder = RefreshLease.acquire(url, timeout + LEASE_MARGIN)
+        if not holder:
+            started = time.time()
+            RefreshLease.wait(url, timeout + LEASE_MARGIN)
+            timings['wait'] = time.time() - started
+            sched = cls.lookup(url)
+            if not sched or not sched.has_events():
+                return None
+            cls._cache[url] = (sched, time.time())
+            return sched
+        try:
+            return cls._refresh(url, timeout, timings)
+        finally:
+            RefreshLease.release(url, holder)
+
+    @classmethod
+    def _refresh(cls, url, timeout, timings):
+        """
+        the refresh that holds the lease: see refresh.
+
+        Returns: Schedule instance with refreshed schedule, or None
+        """
+        sched = cls.lookup(url)
+        validators = {}
+        if sched and sched.has_events() and sched.key().name():
+            # (an unkeyed schedule is fetched in full, to be replaced)
+            validators = {'etag': sched.etag,
+                          'last_modified': sched.last_modified,
+                          'content_hash': sched.content_hash}
+        feed = feed_for(url)
+        started = time.time()
+        with span('feed'):
+            events = get_feed(url, validators, timeout)
+        timings['fetch'] = time.time() - started
+        if events is UNCHANGED:
+            logging.info("schedule unchanged at %s" % url)
+            with span('datastore'):
+                sched = db.run_in_transaction(cls._store_validators, url,
+                                              validators)
+            cls._cache[url] = (sched, time.time())
+            return sched
+        if not events:
+            return None
+        started = time.time()
+        decoded = ScheduleEvents.from_dicts(events, feed.team)
+        answers = decoded.answer_table(oraclenow().date().isoformat())
+        timings['build'] = time.time() - started
+        started = time.time()
+        read = sched
+        with span('datastore'):
+            sched, new = db.run_in_transaction(cls._store, url, read,
+                                               decoded, answers, validators)
+            if read and not read.key().name():
+                read.delete() # replaced by the keyed schedule
+        timings['store'] = time.time() - started
+        cls._cache[url] = (sched, time.time())
+        if not new:
+            return sched # another refresh stored this feed first
+        cls._decoded.put((url, sched.timestamp), decoded)
+        cls._answer_tables.put((url, sched.timestamp), answers)
+        for listener in cls._listeners:
+            listener(url)
+        return sched
+
+    @classmethod
+    def _store(cls, url, read, decoded, answers, validators):
+        """
+        store decoded as the next version of the schedule for url, and
+        the changes from the version before as its ScheduleChange, in the
+        schedule's entity group. Run in a transaction, so the version is
+        the one after whatever is stored, not after what refresh read. read
+        is what refresh read: an unkeyed schedule stored before schedules
+        were keyed by url is carried on from (see lookup).
+
+        Returns: (Schedule, True), or (Schedule, False) if the stored
+        schedule already has this feed body and was left alone
+        """
+        key_name = cls.key_name_for(url)
+        sched = previous = cls.get_by_key_name(key_name)
+        if sched is None:
+            sched = cls(key_name=key_name, url=url)
+            if read:
+                sched.version, previous = read.version, read
+        elif (sched.has_events() and
+              sched.content_hash == validators.get('content_hash')):
+            return sched, False
+        if previous and previous.has_events():
+            previous = previous.get_decoded()
+        else:
+            previous = None
+        sched.etag = validators.get('etag')
+        sched.last_modified = validators.get('last_modified')
+        sched.content_hash = validators.get('content_hash')
+        sched.data = db.Blob(decoded.encode())
+        sched.json = None
+        sched.answers = json.dumps(answers)
+        sched.timestamp = datetime.now()
+        sched.version = (sched.version or 0) + 1
+        stored = [sched]
+        if previous:
+            stored.append(ScheduleChange(
+                    parent=sched,
+                    key_name=ScheduleChange.key_name_for(sched.version),
+                    changes=json.dumps(diff_events(previous, decoded))))
+        db.put(stored)
+        return sched, True
+
+    @classmethod
+    def _store_validators(cls, url, validators):
+        """
+        store the new validators refresh got for an unchanged feed body,
+        unless another refresh has stored a different body meanwhile. Run
+        in a transaction.
+
+        Returns: the stored Schedule instance for the url
+        """
+        sched = cls.get_by_key_name(cls.key_name_for(url))
+        if (sched.content_hash == validators.get('content_hash') and
+            (sched.etag, sched.last_modified) !=
+            (validators.get('etag'), validators.get('last_modified'))):
+            sched.etag = validators.get('etag')
+            sched.last_modified = validators.get('last_modified')
+            sched.put()
         return sched
 
-    def get_events(self, min_isodate=None):
-        """decode instance json into a dictionary of event dictionaries keyed
-        by isodate string, limited by min_isodate (today if null).
-        Cache the parsed dictionary for speed during the lifetime of
-        this app.
+    @classmethod
+    def on_refresh(cls, listener):
+        """
+        have refresh call listener(url) each time it stores a new version
+        of the schedule for url, so that caches of anything derived from
+        the old version can be dropped.
+        """
+        cls._listeners.append(listener)
 
-        Returns: list of event dictionaries for given date and beyond
+    def get_version(self):
+        """
+        Returns: the version counter of this schedule, 0 if it predates them
+        """
+        return self.version or 0
+
+    def get_changes(self, since):
+        """
+        the changes to the events from version since of this schedule to
+        this version, composed from the ScheduleChange refresh stored for
+        each version in between. If since isn't a version we have changes
+        from, the result is instead all the events, flagged 'reset'.
+
+        Returns: dictionary of 'version' and 'since', then 'added' and
+        'modified' event dictionaries and 'removed' event ids (see
+        diff_events), or 'reset' and 'events'
+        """
+        key = (self.url, self.timestamp, since)
+        changes = self._changes.get(key)
+        if changes is not None:
+            return changes
+        version = self.get_version()
+        changes = {'version': version, 'since': since}
+        stored = []
+        if 0 < since <= version:
+            stored = ScheduleChange.get_by_key_name(
+                [ScheduleChange.key_name_for(v)
+                 for v in range(since + 1, version + 1)], parent=self)
+        if since == version:
+            changes.update(added=[], removed=[], modified=[])
+        elif stored and None not in stored:
+            changes.update(compose_changes(
+                    [json.loads(change.changes) for change in stored]))
+        else:
+            changes.update(reset=True, events=self.get_decoded().keyed())
+        self._changes.put(key, changes)
+        return changes
+
+    def has_events(self):
+        """
+        Returns: whether this schedule has stored events, in either form
+        """
+        return bool(self.data or self.json)
+
+    def get_decoded(self):
+        """
+        the ScheduleEvents for this version of the schedule, decoding the
+        instance data (or the json of schedules stored before it) only if
+        this version isn't already in the LRU cache.
+
+        """
+        key = (self.url, self.timestamp)
+        decoded = self._decoded.get(key)
+        if decoded is None:
+            team = feed_for(self.url).team
+            with span('decode'):
+                if self.data:
+                    decoded = ScheduleEvents.decode(self.data, team)
+                else:
+                    decoded = ScheduleEvents.from_dicts(json.loads(self.json),
+                                                        team)
+            self._decoded.put(key, decoded)
+        return decoded
+
+    def get_answers(self):
+        """
+        the answer table for this version of the schedule, decoding the
+        stored one only if this version isn't already in the LRU cache.
+        Schedules stored without one get a table built from their events.
+
+        """
+        key = (self.url, self.timestamp)
+        answers = self._answer_tables.get(key)
+        if answers is None:
+            if self.answers:
+                with span('decode'):
+                    answers = json.loads(self.answers)
+            else:
+                answers = self.get_decoded().answer_table(
+                    oraclenow().date().isoformat())
+            self._answer_tables.put(key, answers)
+        return answers
+
+    def get_answer(self, isodate=None):
+        """
+        the answer for isodate (today if None), looked up in the answer
+        table. Only dates before the table's first day fall back on
+        working the answer out from the events.
+
+        Returns: [is_home, today message, tomorrow message]
+        """
+        if not isodate:
+            isodate = oraclenow().date().isoformat()
+        return self.lookup_answer(self.get_answers(), isodate)
 
+    def lookup_answer(self, answers, isodate):
+        """
+        the answer for isodate from the answer table answers, falling
+        back on the events for dates before the table's first day.
         """
-        if not min_isodate:
-            min_isodate = oraclenow().date().isoformat()
         try:
-            return self._events[min_isodate]
+            return answers['days'][isodate]
         except KeyError:
             pass
-        schedule = [e for e in json.loads(self.json) if min_isodate <= e['date']]
-        self._events[min_isodate] = schedule
-        return schedule
+        if isodate > answers['last']:
+            return answers['after']
+        decoded = self.get_decoded()
+        with span('answer'):
+            return decoded.answer(isodate)
 
-    def get_next_here_event(self, isodate=None):
+    def get_answers_between(self, first_isodate, last_isodate):
         """
-        return an event dictionary for the earliest event on or after
-        the given date, or None if no events are scheduled.
-        If isodate is None, use today
+        the answers for every day from first_isodate through last_isodate,
+        in date order, generated as one walk over the answer table.
+        Raises ValueError if either isodate is malformed.
 
-        Returns: an event dictionary, or none if no more games scheduled for here
+        Returns: iterator of (isodate, [is_home, today message, tomorrow message])
         """
-        for e in self.get_events(isodate):
-            if e['is_here']:
-                return e
-        return None
+        first = isodate_ordinal(first_isodate)
+        last = isodate_ordinal(last_isodate)
+        answers = self.get_answers()
+        for day in xrange(first, last + 1):
+            isodate = date.fromordinal(day).isoformat()
+            yield isodate, self.lookup_answer(answers, isodate)
+
+class ScheduleChange(db.Model):
+    """
+    the changes to a schedule's events made by one refresh, stored by
+    refresh as json (see diff_events) as a child of the Schedule, under a
+    key name for the version the changes produced.
+
+    """
+    changes = db.TextProperty()
 
     @staticmethod
-    def next_isodate(iso, days=1):
+    def key_name_for(version):
+        return 'v%d' % version
+
+def diff_events(old, new):
+    """
+    the changes from ScheduleEvents old to new, matching events by the
+    ids of ScheduleEvents.keyed. A game moved to another day is removed
+    and added.
+
+    Returns: dictionary of 'added' and 'modified' event dictionaries
+    (with their ids) and 'removed' event ids
+    """
+    before = dict((event['id'], event) for event in old.keyed())
+    added, modified = [], []
+    for event in new.keyed():
+        if event['id'] not in before:
+            added.append(event)
+        elif before.pop(event['id']) != event:
+            modified.append(event)
+    return {'added': added, 'removed': sorted(before), 'modified': modified}
+
+def compose_changes(changes):
+    """
+    compose a list of diff_events results, oldest first, into the one
+    diff from the first's old events to the last's new events.
+
+    Returns: dictionary of 'added', 'removed' and 'modified' as for
+    diff_events
+    """
+    existed = {} # whether each event id changed was in the first old events
+    final = {} # each changed id's last event dictionary, or None if removed
+    for change in changes:
+        for event in change['added']:
+            existed.setdefault(event['id'], False)
+            final[event['id']] = event
+        for event in change['modified']:
+            existed.setdefault(event['id'], True)
+            final[event['id']] = event
+        for id in change['removed']:
+            existed.setdefault(id, True)
+            final[id] = None
+    ids = sorted(final)
+    return {'added': [final[id] for id in ids
+                      if final[id] and not existed[id]],
+            'removed': [id for id in ids if final[id] is None and existed[id]],
+            'modified': [final[id] for id in ids
+                         if final[id] and existed[id]]}
+
+class RefreshLease(db.Model):
+    """
+    held by the Schedule.refresh running for a url, so that refreshes of
+    the url started anywhere else wait for it rather than fetch the feed
+    too. The key name is Schedule.key_name_for(url). A lease that hasn't
+    been released by the time it expires is taken to have died with its
+    holder.
+
+    """
+    holder = db.StringProperty(indexed=False) # token of the holding refresh
+    expires = db.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def acquire(cls, url, seconds):
         """
-        add days to isodate, return new isodate string
+        take the lease for url for seconds, if no one else holds it.
+
+        Returns: the holder token to release it with, or None if it is held
         """
-        next = (datetime.strptime(iso, "%Y-%m-%d").date() + timedelta(days=days))
-        return next.isoformat()
+        key_name = Schedule.key_name_for(url)
+        holder = uuid4().hex
+
+        def take():
+            lease = cls.get_by_key_name(key_name)
+            if lease and lease.expires > datetime.now():
+                return None
+            cls(key_name=key_name, holder=holder,
+                expires=datetime.now() + timedelta(seconds=seconds)).put()
+            return holder
+        try:
+            with span('datastore'):
+                return db.run_in_transaction(take)
+        except db.TransactionFailedError:
+            return None # lost to another refresh taking it at once
+
+    @classmethod
+    def release(cls, url, holder):
+        """release the lease for url, if holder still holds it"""
+        key_name = Schedule.key_name_for(url)
 
-    def get_next_non_here_datetime(self, isodate=None):
+        def give_up():
+            lease = cls.get_by_key_name(key_name)
+            if lease and lease.holder == holder:
+                lease.delete()
+        try:
+            with span('datastore'):
+                db.run_in_transaction(give_up)
+        except db.Error, e:
+            logging.error("can't release refresh lease: " + str(e))
+
+    @classmethod
+    def wait(cls, url, seconds):
+        """
+        wait up to seconds for the lease for url to be released or expire,
+        checking every LEASE_POLL seconds.
         """
-        return the earliest day on or after the given date having no
-        event here. If isodate is None, use today.
+        key_name = Schedule.key_name_for(url)
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            with span('datastore'):
+                lease = cls.get_by_key_name(key_name)
+            if not lease or lease.expires <= datetime.now():
+                return
+            time.sleep(min(LEASE_POLL, max(0, deadline - time.time())))
 
-        Returns: an isodate string
+class RefreshJob(db.Model):
+    """
+    a requested refresh of the schedule for a url, run by a task and
+    recording its progress so that its state can be polled. The key name
+    is the job id. Use RefreshJob.start() to get one.
+
+    """
+    url = db.StringProperty()
+    state = db.StringProperty(indexed=False) # QUEUED, RUNNING, DONE or FAILED
+    created = db.DateTimeProperty()
+    started = db.DateTimeProperty(indexed=False)
+    finished = db.DateTimeProperty(indexed=False)
+    timings = db.TextProperty() # json seconds by phase, see Schedule.refresh
+    error = db.StringProperty(indexed=False)
+
+    @classmethod
+    def start(cls, url=SCHED_URL):
         """
-        if isodate is None:
-            isodate = oraclenow().date().isoformat()
-        for e in self.get_events(isodate):
-            if (not e['is_here'] or isodate != e['date']):
-                break
-            isodate = Schedule.next_isodate(isodate)
-        return datetime.strptime(isodate, "%Y-%m-%d")
+        enqueue a refresh of the schedule for url, unless one is already
+        queued or running, or was enqueued in this JOB_PERIOD.
+
+        Returns: the RefreshJob for the refresh
+        """
+        latest = cls.all().filter("url =", url).order("-created").get()
+        if (latest and latest.state in (QUEUED, RUNNING) and
+            latest.created > datetime.now() - timedelta(seconds=JOB_TIMEOUT)):
+            return latest
+        name = '%s-%d' % (md5(url).hexdigest()[:16],
+                          int(time.time()) // JOB_PERIOD)
+        job = cls.get_or_insert(name, url=url, state=QUEUED,
+                                created=datetime.now())
+        if job.state == QUEUED:
+            # named for the job, so a job enqueued twice runs once
+            try:
+                deferred.defer(run_refresh_job, name, _name='job-' + name)
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                pass # another instance enqueued this job
+            except taskqueue.Error, e:
+                logging.error("can't enqueue refresh job: " + str(e))
+                job.finish(FAILED, error="can't enqueue: " + str(e))
+        return job
+
+    @classmethod
+    def prune(cls, max_age=JOB_KEEP, batch=500):
+        """
+        delete the jobs created more than max_age seconds ago, batch at
+        a time. By then a job has finished, or is long taken for dead,
+        and its status is of no more interest.
+
+        Returns: the number of jobs deleted
+        """
+        before = datetime.now() - timedelta(seconds=max_age)
+        deleted = 0
+        while True:
+            keys = cls.all(keys_only=True).filter(
+                "created <", before).fetch(batch)
+            if not keys:
+                return deleted
+            db.delete(keys)
+            deleted += len(keys)
+
+    @property
+    def id(self):
+        return self.key().name()
+
+    def finish(self, state, timings=None, error=None):
+        """record that the job ended in state, and store it"""
+        self.state = state
+        self.finished = datetime.now()
+        if timings is not None:
+            self.timings = json.dumps(timings)
+        self.error = error
+        self.put()
+
+    def status(self):
+        """
+        Returns: dictionary of the job's id, url, state, error, times as
+        isoformat strings, and seconds by phase: 'queued' (waiting to
+        start), those Schedule.refresh records, and 'total'
+        """
+        timings = json.loads(self.timings) if self.timings else {}
+        if self.started:
+            timings['queued'] = (self.started - self.created).total_seconds()
+        if self.finished:
+            timings['total'] = (self.finished - self.created).total_seconds()
+        times = dict((name, value.isoformat() if value else None)
+                     for name, value in (('created', self.created),
+                                         ('started', self.started),
+                                         ('finished', self.finished)))
+        return dict(times, id=self.id, url=self.url, state=self.state,
+                    error=self.error, timings=timings)
+
+def run_refresh_job(name):
+    """
+    task queue entry point for RefreshJob.start: refresh the job's
+    schedule and record how that went. Failures are recorded rather than
+    raised, so the task isn't retried.
+    """
+    job = RefreshJob.get_by_key_name(name)
+    if not job or job.state != QUEUED:
+        return
+    job.state = RUNNING
+    job.started = datetime.now()
+    job.put()
+    timings = {}
+    try:
+        sched = Schedule.refresh(url=job.url, timings=timings)
+    except Exception, e:
+        logging.exception("refresh job %s failed" % name)
+        job.finish(FAILED, timings, error=str(e))
+        return
+    if sched:
+        job.finish(DONE, timings)
+    else:
+        job.finish(FAILED, timings,
+                   error="feed couldn't be fetched or had no events")
+
+def refresh_task(url=SCHED_URL, every_secs=(24 * 3600)):
+    """
+    task queue entry point for Schedule.refresh_later. Skips the refresh
+    if the stored schedule has been refreshed since the task was enqueued.
+    """
+    sched = Schedule.lookup(url)
+    if (sched and sched.has_events() and
+        sched.timestamp >= datetime.now() - timedelta(seconds=every_secs)):
+        return
+    Schedule.refresh(url=url)
+
+def refresh_all(names=None, workers=REFRESH_WORKERS, timeout=FEED_TIMEOUT):
+    """
+    refresh the schedules of the named feeds (all of FEEDS if None)
+    concurrently, on at most workers threads. Each feed gets timeout
+    seconds, so the whole job takes at most about
+    timeout * ceil(len(names) / workers) seconds.
 
-def get_feed(url=SCHED_URL):
+    Returns: dictionary of refreshed Schedules by feed name, with None
+    for feeds whose refresh failed
     """
-    fetch the giants schedule as a remote csv file, parse it,
-    and create a list of events from it.
+    if names is None:
+        names = sorted(FEEDS)
+    pending = Queue()
+    for name in names:
+        pending.put(FEEDS[name])
+    results = {}
+
+    def worker():
+        while True:
+            try:
+                feed = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                results[feed.name] = Schedule.refresh(feed.url, timeout)
+            except Exception, e:
+                logging.error("can't refresh %s: %s" % (feed.name, e))
+                results[feed.name] = None
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(workers, len(names)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def fetch_feed(url=SCHED_URL, validators=None, timeout=FEED_TIMEOUT):
+    """
+    GET the feed url, conditional on the 'etag' and 'last_modified'
+    validators from a previous fetch, if any (see get_feed), giving up
+    if the server doesn't respond within timeout seconds.
+
+    Returns: the response, its body not yet read, or UNCHANGED
+    """
+    if validators is None:
+        validators = {}
+    request = Request(url)
+    if validators.get('etag'):
+        request.add_header('If-None-Match', validators['etag'])
+    if validators.get('last_modified'):
+        request.add_header('If-Modified-Since', validators['last_modified'])
+    try:
+        return urlopen(request, timeout=timeout)
+    except HTTPError, e:
+        if e.code == 304:
+            return UNCHANGED
+        raise
+
+def feed_lines(response, digest, deadline=None):
+    """
+    read the feed response a line at a time, adding the raw bytes
+    to digest as they go by, and raising IOError if still reading
+    after the deadline (a time.time()).
+
+    Returns: generator of unicode lines, without line endings
+    """
+    for line in response:
+        if deadline and time.time() > deadline:
+            raise IOError("feed took too long")
+        digest.update(line)
+        yield line.decode('iso-8859-1').rstrip('\r\n')
+
+def ical_datetime(name, params, value, timezones={}):
+    """
+    decode a date-time property such as DTSTART, given its line as
+    ics.parse.scan_line splits it: name, params and value. The
+    forms feeds actually use -- UTC (...Z), zoned (;TZID=) and floating
+    date-times, and ;VALUE=DATE dates -- are decoded directly, the way
+    ics.utils.iso_to_arrow interprets them: a TZID that isn't among the
+    VTIMEZONEs in timezones, or no TZID at all, means UTC. Anything else
+    goes through iso_to_arrow itself.
+
+    Returns: an aware datetime
+    """
+    tz = timezones.get(params['TZID'][0], utc) if 'TZID' in params else utc
+    try:
+        if len(value) == 16 and value[8] == 'T' and value[15] == 'Z':
+            tz = utc
+        elif len(value) == 8 and 'DATE' in params.get('VALUE', ()):
+            value += 'T000000'
+        elif len(value) != 15 or value[8] != 'T':
+            raise ValueError("not a basic ical date-time: " + value)
+        return datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                        int(value[9:11]), int(value[11:13]), int(value[13:15]),
+                        tzinfo=tz)
+    except ValueError:
+        return iso_to_arrow(ContentLine(name, params, value), timezones).datetime
+
+def feed_games(lines):
+    """
+    get_feed's fast path through the ical feed. It needs only the
+    SUMMARY, LOCATION and DTSTART of each VEVENT, so those are picked
+    out of the lines as they stream past, without building the ics
+    Calendar/Container/Event objects, or Arrows for the properties we
+    don't use. Each VEVENT is yielded as soon as its END line has been
+    read, so only one event is held at a time. VTIMEZONE blocks (which
+    precede the events that use them) are collected for ical_datetime.
+
+    Returns: generator of (summary, location, begin datetime) per
+    VEVENT, in feed order, with summary and location unescaped
+    """
+    timezones = {}
+    depth, component, props, vtimezone = 0, None, None, None
+    for line in unfold_lines(lines):
+        name, params, value = scan_line(line)
+        if name == 'BEGIN':
+            depth += 1
+            if depth == 2:
+                component, props = value, {}
+                vtimezone = [line] if value == 'VTIMEZONE' else None
+            elif vtimezone is not None:
+                vtimezone.append(line)
+        elif name == 'END':
+            if vtimezone is not None:
+                vtimezone.append(line)
+            if depth == 2 and component == 'VEVENT':
+                summary, location = props.get('SUMMARY'), props.get('LOCATION')
+                yield (summary and unescape_string(summary[2]),
+                       location and unescape_string(location[2]),
+                       ical_datetime(*props['DTSTART'], timezones=timezones))
+            elif depth == 2 and component == 'VTIMEZONE':
+                tzs = tzical(StringIO('\n'.join(vtimezone).encode('utf-8')))
+                for tzid in tzs.keys():
+                    timezones[tzid] = tzs.get(tzid)
+                vtimezone = None
+            depth -= 1
+        elif vtimezone is not None:
+            if depth > 2 or not name.startswith('X-'):
+                vtimezone.append(line) # less the X- lines, as ics does
+        elif depth == 2 and component == 'VEVENT' and name in GAME_PROPERTIES:
+            if name in props:
+                raise ValueError("A VEVENT must have at most one " + name)
+            props[name] = (name, params, value)
+
+def feed_event(summary, location, begin, team='Giants', venue='Oracle'):
+    """
+    the event dictionary for one game in the feed of team's games,
+    whose home games at venue are the ones here.
+
+    Returns: (begin localized to Oracle Park, event dictionary), or
+    None if the game has already been played
+    """
+    if summary.startswith("FINAL"):
+        return None # skip games already played
+    begin = localize(begin)
+    is_home = (summary.endswith(team))
+    is_here = location.startswith(venue)
+    them = summary.split(" vs. ")[0 if is_home else 1]
+    return (begin, {
+        'date': begin.date().isoformat(),
+        'day': begin.strftime("%A, %b %d"),
+        'time': begin.strftime("%I:%M %p"),
+        'is_home': is_home,
+        'is_here': is_here,
+        'location': location,
+        'them': them
+    })
+
+def get_feed(url=SCHED_URL, validators=None, timeout=FEED_TIMEOUT):
+    """
+    fetch a team's schedule as a remote ical file, parse it,
+    and create a list of events from it. The feed is parsed as
+    it is read rather than after it has all arrived (see feed_games).
+
+    validators is a dictionary of the 'etag', 'last_modified' and
+    'content_hash' (sha1 of the body) from the last fetch of this
+    feed. The fetch is conditional on the first two, and a body
+    matching content_hash also counts as unchanged, though its etag
+    and last_modified are still updated, so the next fetch can be
+    conditional on the server's current validators. Otherwise
+    validators is updated in place to describe this fetch.
+
+    Fetching and parsing are abandoned after timeout seconds.
 
-    Returns: a sorted list of event dictionaries, or None
+    Returns: a sorted list of event dictionaries, UNCHANGED if
+    the feed hasn't changed since validators were set, or None
     if there is a problem (eg, an http timeout. they happen.)
     """
+    if validators is None:
+        validators = {}
     sched = []
+    feed = feed_for(url)
+    deadline = time.time() + timeout
     logging.info("get_feed %s" % url)
     try:
-        c = Calendar(urlopen(SCHED_URL).read().decode('iso-8859-1'))
-        for event in c.events:
-            if event.name.startswith("FINAL"):
-                continue # skip games already played
-            event.begin = localize(event.begin)
-            is_home = (event.name.endswith("Giants"))
-            is_here = event.location.startswith('Oracle')
-            them = event.name.split(" vs. ")[0 if is_home else 1]
-            sched.append({
-                'date': event.begin.date().isoformat(),
-                'day': event.begin.strftime("%A, %b %d"),
-                'time': event.begin.strftime("%I:%M %p"),
-                'is_home': is_home,
-                'is_here': is_here,
-                'location': event.location,
-                'them': them
-            })
+        response = fetch_feed(url, validators, timeout)
+        if response is UNCHANGED:
+            return UNCHANGED
+        digest = sha1()
+        for game in feed_games(feed_lines(response, digest, deadline)):
+            event = feed_event(*game, team=feed.team, venue=feed.venue)
+            if event:
+                sched.append(event)
     except Exception, e:
         logging.error("can't download/parse schedule: " + str(e))
         return None
-    return sched
+    content_hash = digest.hexdigest()
+    validators['etag'] = response.info().getheader('ETag')
+    validators['last_modified'] = response.info().getheader('Last-Modified')
+    if content_hash == validators.get('content_hash'):
+        return UNCHANGED
+    validators['content_hash'] = content_hash
+    sched.sort(key=itemgetter(0))
+    return [e for begin, e in sched]
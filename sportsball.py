@@ -1,69 +1,561 @@
-from schedule import Schedule, oraclenow
+from schedule import (Schedule, RefreshJob, oraclenow, localize, refresh_all,
+                      isodate_ordinal)
+from cache import LRUCache
+from microcache import MicroCache
+from admission import Admission, ConcurrencyLimit
+import metrics
+from metrics import span
 from google.appengine.ext.webapp import template
 import webapp2
 import logging
-from datetime import date, datetime
+import json
+import os
+import gzip
+import hmac
+import re
+import threading
+import time
+from StringIO import StringIO
+from calendar import timegm
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from hashlib import md5
+from urlparse import parse_qsl
+from datetime import date, datetime, timedelta
+try:
+    import brotli
+except ImportError:
+    brotli = None # optional: without it bodies are offered as gzip only
 
-def sched_message(isodate=None):
+DEFAULT_VERB = 'hosed'
+MAX_RANGE_DAYS = 366 # longest window /range will answer
+CHANGES_WAIT = 25 # most seconds /schedule/changes waits for a new version
+CHANGES_POLL = 5 # seconds between its checks for versions stored elsewhere
+# most /schedule/changes requests waiting at once: below the 10 concurrent
+# requests a python27 instance takes by default, leaving room for the rest
+CHANGES_WAITERS = 6
+_templates = {} # compiled templates for this app instance, by path
+_pages = LRUCache(maxsize=32) # rendered DEFAULT_VERB 8ball pages
+_verb_pages = LRUCache(maxsize=128) # rendered 8ball pages for other verbs
+_bodies = LRUCache(maxsize=16) # other encoded bodies, by schedule version
+_refreshed = threading.Condition() # notified when refresh stores a version
+admission = Admission() # client token buckets and admission counts
+
+# route arguments AdmittedPage lets through, besides isodates
+VERB_RE = re.compile(r'^[\w-]{1,32}$', re.UNICODE)
+JOB_ID_RE = re.compile(r'^[0-9a-f]{16}-\d+$')
+REASONS = {429: 'Too Many Requests'}
+
+def render(path, values):
+    """
+    render the template at path with the dictionary values, compiling
+    the template only the first time this app instance uses it.
+
+    Returns: the rendered template, as unicode
+    """
+    compiled = _templates.get(path)
+    if compiled is None:
+        compiled = _templates[path] = template.load(path)
+    with span('render'):
+        return compiled.render(template.Context(values))
+
+def encodings(body):
+    """
+    body (a byte string) in each content-coding we can serve, compressed
+    once here so that requests are only negotiated, not compressed.
+
+    Returns: dictionary of bodies by coding, body itself as 'identity'
+    """
+    out = StringIO()
+    with span('compress'):
+        with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9,
+                           mtime=0) as f:
+            f.write(body)
+        variants = {'identity': body, 'gzip': out.getvalue()}
+        if brotli is not None:
+            variants['br'] = brotli.compress(body)
+    return variants
+
+# the content-codings encodings() makes, besides 'identity'
+CODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def accepted_codings(header):
+    """
+    Returns: set of the content-codings an Accept-Encoding header allows
+    """
+    accepted, refused = set(), set()
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding, q = coding.strip().lower(), params.strip()
+        try:
+            allowed = not q.startswith('q=') or float(q[2:]) > 0
+        except ValueError:
+            allowed = False
+        (accepted if allowed else refused).add(coding)
+    if '*' in accepted:
+        accepted.update(set(('br', 'gzip')) - refused)
+    return accepted
+
+def sched_message(isodate=None, sched=None):
     """
     return an informative message about today's event,
-    as a list of strings (one per line)
-    """
-    if not isodate:
-        isodate = oraclenow().date().isoformat()
-    sched = Schedule.get()
-    e = sched.get_next_here_event(isodate)
-    if not e:
-        return ['No more home games!', "(...until next year...)"]
-    elif e['date'] != isodate:
-        return ['No home game today!',
-                'All quiet until %s, when Giants play %s at %s' % (
-                    e['day'], e['them'], e['time'])]
-    else:
-        quiet = sched.get_next_non_here_datetime(isodate)
-        return ['Giants play %s at %s\n' % (e['them'], e['time']),
-                "No peace and quiet until %s" % quiet.strftime("%A, %b %d")]
-
-class IndexPage(webapp2.RequestHandler):
+    as a list of strings (one per line). sched is the Schedule
+    to consult, if the caller already has it.
+    """
+    if not sched:
+        sched = Schedule.get()
+    return sched.get_answer(isodate)[1:]
+
+def pacific_midnight(day):
+    """the start of day (a date) at Oracle Park, as an aware datetime"""
+    return localize(datetime.combine(day, datetime.min.time()))
+
+def valid_args(args):
+    """
+    Returns: whether the route arguments args (a dictionary) are well
+    formed, so that a request for nonsense can be turned away early
+    """
+    if 'isodate' in args:
+        try:
+            isodate_ordinal(args['isodate'])
+        except ValueError:
+            return False
+    if 'verb' in args:
+        verb = args['verb']
+        try:
+            if isinstance(verb, str):
+                verb = verb.decode('utf-8')
+        except UnicodeDecodeError:
+            return False
+        if not VERB_RE.match(verb):
+            return False
+    if 'job_id' in args and not JOB_ID_RE.match(args['job_id']):
+        return False
+    return True
+
+class AdmittedPage(webapp2.RequestHandler):
+    """
+    base for the request handlers, which only handles a request if its
+    route arguments are valid (404 if not), the client has a token in
+    its bucket for this handler, filling at rate a second up to burst
+    (429 if not), and there is one of slots, a ConcurrencyLimit, to be
+    had (503 if not). Each class without a rate is unlimited, as is
+    each without slots. Outcomes are counted in admission.
+
+    """
+    rate, burst = None, None
+    slots = None
+
+    def dispatch(self):
+        route = self.__class__.__name__
+        metrics.set_route(route)
+        if not valid_args(self.request.route_kwargs):
+            return self.reject(route, 'invalid', 404)
+        if self.rate:
+            wait = admission.admit(self.request.remote_addr, route,
+                                   self.rate, self.burst)
+            if wait:
+                return self.reject(route, 'rate', 429, wait)
+        if self.slots and not self.slots.enter():
+            return self.reject(route, 'busy', 503, 1)
+        admission.count(route, 'admitted')
+        try:
+            return webapp2.RequestHandler.dispatch(self)
+        finally:
+            if self.slots:
+                self.slots.exit()
+
+    def reject(self, route, reason, status, retry_after=None):
+        admission.count(route, reason)
+        # webapp2 has no reason phrase of its own for 429
+        self.response.set_status(status, REASONS.get(status))
+        self.response.headers['Content-Type'] = 'text/plain'
+        if retry_after is not None:
+            self.response.headers['Retry-After'] = str(int(retry_after) + 1)
+        self.response.write("%d %s\n" % (status, self.response.status_message))
+
+class CachedPage(AdmittedPage):
+    """
+    base for pages whose output only changes with the schedule version,
+    the app version, and the page's own arguments (and, for pages about
+    today, the Pacific date). Responses carry an ETag and Last-Modified
+    derived from those, and may be cached until the next Pacific midnight.
+    send() serves bodies precompressed by encodings(); each coding of a
+    body is a representation of its own, with the coding added to its
+    ETag (eg "...-gzip").
+
+    """
+    def not_modified(self, sched, key, today=False, codings=()):
+        """
+        set validators and Cache-Control on the response for sched and
+        key (a tuple of the page's arguments), and send a 304 if the
+        request's If-None-Match or If-Modified-Since match them. today
+        says the output also changes when the Pacific date does, and
+        codings are those the page will send() besides 'identity'.
+
+        Returns: True if a 304 was sent, and the page needn't be rendered
+        """
+        now = oraclenow()
+        midnight = pacific_midnight(now.date() + timedelta(days=1))
+        modified = timegm(sched.timestamp.utctimetuple())
+        if today:
+            modified = max(modified, timegm(
+                    pacific_midnight(now.date()).utctimetuple()))
+        version = [os.environ.get('CURRENT_VERSION_ID', ''), sched.url,
+                   sched.timestamp.isoformat()] + list(key)
+        self.etag = md5('\n'.join(
+                part.encode('utf-8') if isinstance(part, unicode) else part
+                for part in version)).hexdigest()
+        etag = self.tagged(self.negotiate(codings))
+        headers = self.response.headers
+        headers['ETag'] = etag
+        headers['Last-Modified'] = formatdate(modified, usegmt=True)
+        headers['Cache-Control'] = 'public, max-age=%d' % max(
+            0, int((midnight - now).total_seconds()))
+        headers['Vary'] = 'Accept-Encoding'
+
+        etags = self.request.headers.get('If-None-Match')
+        since = self.request.headers.get('If-Modified-Since')
+        if etags is not None:
+            etags = [t.strip() for t in etags.split(',')]
+            match = '*' in etags or etag in [
+                t[2:] if t.startswith('W/') else t for t in etags]
+        elif since is not None:
+            parsed = parsedate_tz(since)
+            match = parsed is not None and modified <= mktime_tz(parsed)
+        else:
+            match = False
+        if match:
+            self.response.set_status(304)
+        return match
+
+    def negotiate(self, codings):
+        """
+        Returns: the smallest of codings that the request's
+        Accept-Encoding allows, or 'identity'
+        """
+        accepted = accepted_codings(
+            self.request.headers.get('Accept-Encoding', ''))
+        for coding in ('br', 'gzip'):
+            if coding in codings and coding in accepted:
+                return coding
+        return 'identity'
+
+    def tagged(self, coding):
+        """
+        Returns: the ETag of the coding of this page not_modified named
+        """
+        if coding == 'identity':
+            return '"%s"' % self.etag
+        return '"%s-%s"' % (self.etag, coding)
+
+    def send(self, variants):
+        """
+        write the best of variants (see encodings) that the request's
+        Accept-Encoding allows, preferring the smallest, with its ETag.
+        """
+        coding = self.negotiate(variants)
+        if coding != 'identity':
+            self.response.headers['Content-Encoding'] = coding
+        self.response.headers['ETag'] = self.tagged(coding)
+        self.response.write(variants[coding])
+
+class IndexPage(CachedPage):
+    rate, burst = 2, 30
+
     def get(self, isodate):
+        sched = Schedule.get()
+        if self.not_modified(sched, ('index', isodate)):
+            return
         self.response.headers['Content-Type'] = 'text/plain'
-        self.response.write("\n".join(sched_message(isodate)))
+        self.response.write("\n".join(sched_message(isodate, sched)))
+
+class EightballPage(CachedPage):
+    rate, burst = 2, 30
 
-class EightballPage(webapp2.RequestHandler):
-    def get(self, verb="hosed", isodate=None):
-        if not isodate:
+    def get(self, verb=DEFAULT_VERB, isodate=None):
+        dated = bool(isodate)
+        if not dated:
             isodate = oraclenow().date().isoformat()
         sched = Schedule.get()
-        e = sched.get_next_here_event(isodate)
-        logging.info("for isodate %s, isodatetime %s, next home event is %s" % (
-                isodate, oraclenow(), str(e)))
-        is_home = e and e['date'] == isodate
-        message = sched_message(isodate)
-        self.response.write(
-            template.render('templates/8ball.w2', {
+        if self.not_modified(sched, ('8ball', verb, isodate), today=not dated,
+                             codings=CODINGS):
+            return
+        self.send(self.page(sched, verb, isodate))
+
+    @staticmethod
+    def page(sched, verb, isodate):
+        """
+        the rendered page for verb and isodate, rendering it only if this
+        version of the schedule hasn't already been rendered for them.
+        Pages for DEFAULT_VERB are cached apart from those for verbs
+        chosen by visitors, which can't crowd them out.
+
+        Returns: encodings of the page as a utf-8 byte string
+        """
+        if verb == DEFAULT_VERB:
+            pages, key = _pages, (sched.url, sched.timestamp, isodate)
+        else:
+            pages, key = _verb_pages, (sched.url, sched.timestamp, isodate, verb)
+        page = pages.get(key)
+        if page is None:
+            is_home, today, tomorrow = sched.get_answer(isodate)
+            logging.info("for isodate %s, isodatetime %s, answer is %s" % (
+                    isodate, oraclenow(), today))
+            page = encodings(render('templates/8ball.w2', {
                     'verb': verb,
                     'is_home': is_home,
-                    'today': message[0],
-                    'tomorrow': message[1]
-                    }))
+                    'today': today,
+                    'tomorrow': tomorrow
+                    }).encode('utf-8'))
+            pages.put(key, page)
+        return page
+
+class RangePage(CachedPage):
+    """
+    answers for every day from ?from= through ?to= (isodates, to
+    defaulting to from), as json or, with ?format=text, one tab-separated
+    line per day. The output is written a day at a time.
+
+    """
+    rate, burst = 0.5, 10
 
-class SchedulePage(webapp2.RequestHandler):
     def get(self):
+        first = self.request.get('from')
+        last = self.request.get('to') or first
+        fmt = self.request.get('format', 'json')
+        try:
+            days = isodate_ordinal(last) - isodate_ordinal(first) + 1
+        except ValueError:
+            return self.error_text("from and to must be YYYY-MM-DD dates\n")
+        if not 0 < days <= MAX_RANGE_DAYS:
+            return self.error_text("from must be on or before to, and at "
+                                   "most %d days before it\n" % MAX_RANGE_DAYS)
+        if fmt not in ('json', 'text'):
+            return self.error_text("format must be json or text\n")
         sched = Schedule.get()
+        if self.not_modified(sched, ('range', first, last, fmt)):
+            return
+        answers = sched.get_answers_between(first, last)
+        write = self.response.write
+        if fmt == 'text':
+            self.response.headers['Content-Type'] = 'text/plain'
+            for isodate, (is_home, today, tomorrow) in answers:
+                write('\t'.join((isodate, 'home' if is_home else 'quiet',
+                                 today.rstrip(), tomorrow)) + '\n')
+        else:
+            self.response.headers['Content-Type'] = 'application/json'
+            write('{"from": %s, "to": %s, "days": [' % (
+                    json.dumps(first), json.dumps(last)))
+            for i, (isodate, (is_home, today, tomorrow)) in enumerate(answers):
+                write((',\n' if i else '\n') + json.dumps({
+                            'date': isodate, 'is_home': is_home,
+                            'today': today, 'tomorrow': tomorrow}))
+            write(']}\n')
+
+    def error_text(self, message):
+        self.response.set_status(400)
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write(message)
+
+def notify_refreshed(url):
+    with _refreshed:
+        _refreshed.notify_all()
+
+class ChangesPage(AdmittedPage):
+    """
+    the changes to the schedule since the client's version (?since=, or
+    the Last-Event-ID header of an EventSource reconnecting), as json
+    from Schedule.get_changes. If there are none yet, the request waits
+    up to ?wait= (at most CHANGES_WAIT) seconds for one, woken by a
+    refresh in this app instance or finding one stored by another
+    every CHANGES_POLL seconds.
+
+    With Accept: text/event-stream the answer is one Server-Sent Event
+    (or a comment, if nothing changed) with the new version as its id,
+    after which the EventSource reconnects and waits again.
+
+    """
+    rate, burst = 0.5, 5
+    slots = ConcurrencyLimit(CHANGES_WAITERS)
+
+    def get(self):
+        try:
+            since = int(self.request.headers.get('Last-Event-ID') or
+                        self.request.get('since', '0'))
+            wait = min(float(self.request.get('wait', CHANGES_WAIT)),
+                       CHANGES_WAIT)
+        except ValueError:
+            self.response.set_status(400)
+            self.response.headers['Content-Type'] = 'text/plain'
+            self.response.write("since and wait must be numbers\n")
+            return
+        sched = Schedule.get(max_age=CHANGES_POLL)
+        deadline = time.time() + wait
+        while sched.get_version() == since and time.time() < deadline:
+            with _refreshed:
+                _refreshed.wait(min(CHANGES_POLL, deadline - time.time()))
+            sched = Schedule.get(max_age=CHANGES_POLL)
+        changes = sched.get_changes(since)
+        if 'text/event-stream' in self.request.headers.get('Accept', ''):
+            self.response.headers['Content-Type'] = 'text/event-stream'
+            self.response.write('retry: 1000\n')
+            if changes['version'] == since:
+                self.response.write(': no changes\n\n')
+            else:
+                self.response.write('id: %d\nevent: changes\ndata: %s\n\n' % (
+                        changes['version'], json.dumps(changes)))
+        else:
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps(changes))
+
+class SchedulePage(CachedPage):
+    rate, burst = 1, 10
+
+    def get(self):
+        sched = Schedule.get()
+        if self.not_modified(sched, ('schedule.json',), codings=CODINGS):
+            return
         self.response.headers['Content-Type'] = 'application/json'
-        self.response.write(sched.json)
+        key = (sched.url, sched.timestamp, 'schedule.json')
+        body = _bodies.get(key)
+        if body is None:
+            decoded = sched.get_decoded()
+            with span('json'):
+                body = decoded.to_json()
+            body = encodings(body)
+            _bodies.put(key, body)
+        self.send(body)
 
-class RefreshPage(webapp2.RequestHandler):
+class RefreshPage(AdmittedPage):
+    """
+    start a RefreshJob and answer 202 with where to follow it. This only
+    enqueues, so there is no ConcurrencyLimit here: the cap on refreshes
+    is in Schedule.refresh, which runs one at a time per url across app
+    instances, whether started by a job, a task, the cron or a request,
+    and has the others wait for it (see RefreshLease).
+
+    """
+    rate, burst = 0.2, 3
+
+    def get(self):
+        job = RefreshJob.start() # at most one job per JOB_PERIOD
+        self.response.set_status(202)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Location'] = '/refresh/%s' % job.id
+        self.response.write(json.dumps(job.status()))
+
+class RefreshStatusPage(AdmittedPage):
+    rate, burst = 2, 20
+
+    def get(self, job_id):
+        job = RefreshJob.get_by_key_name(job_id)
+        self.response.headers['Content-Type'] = 'application/json'
+        if not job:
+            self.response.set_status(404)
+            self.response.write(json.dumps({'id': job_id,
+                                            'error': 'no such job'}))
+            return
+        self.response.write(json.dumps(job.status()))
+
+class AdmissionPage(AdmittedPage):
     def get(self):
-        sched = Schedule.get(every_secs = 10) # a little DOS protection here
+        stats = admission.stats()
+        stats['slots'] = dict((page.__name__, {'active': page.slots.active,
+                                               'limit': page.slots.limit})
+                              for page in (ChangesPage,))
         self.response.headers['Content-Type'] = 'application/json'
-        self.response.write("Refreshed schedule\n")
+        self.response.write(json.dumps(stats))
+
+class MetricsPage(AdmittedPage):
+    """
+    the metrics export, for a Prometheus scraper. A scraper can't get
+    past the admin login, so this is served outside it, to requests with
+    "Authorization: Bearer <SPORTSBALL_METRICS_TOKEN>" (401 without; 404
+    if the app has no token set).
+
+    """
+    rate, burst = 1, 10
+
+    def get(self):
+        if not metrics.token:
+            return self.reject('MetricsPage', 'disabled', 404)
+        scheme, _, credentials = self.request.headers.get(
+            'Authorization', '').partition(' ')
+        if (scheme.lower() != 'bearer' or
+            not hmac.compare_digest(credentials.strip(), metrics.token)):
+            self.response.headers['WWW-Authenticate'] = 'Bearer'
+            return self.reject('MetricsPage', 'unauthorized', 401)
+        self.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        self.response.write(metrics.export())
+
+def admission_metrics():
+    stats = admission.stats()
+    caches = [('pages', _pages), ('verb_pages', _verb_pages),
+              ('bodies', _bodies), ('responses', microcache.responses),
+              ('decoded', Schedule._decoded),
+              ('answer_tables', Schedule._answer_tables)]
+    return [
+        ('sportsball_admission_total', 'counter',
+         'Requests admitted or rejected, by route and outcome.',
+         [({'route': route, 'outcome': outcome}, n)
+          for route, outcomes in sorted(stats['routes'].items())
+          for outcome, n in sorted(outcomes.items())]),
+        ('sportsball_cache_hits_total', 'counter',
+         'Lookups that found an entry, by cache.',
+         [({'cache': name}, c.hits) for name, c in caches]),
+        ('sportsball_cache_misses_total', 'counter',
+         'Lookups that found no entry, by cache.',
+         [({'cache': name}, c.misses) for name, c in caches]),
+        ('sportsball_cache_entries', 'gauge', 'Entries held, by cache.',
+         [({'cache': name}, len(c)) for name, c in caches]),
+        ]
+
+class RefreshAllTask(AdmittedPage):
+    def get(self):
+        results = refresh_all()
+        failed = sorted(name for name, sched in results.items() if not sched)
+        if failed:
+            logging.error("failed to refresh feeds: %s" % ", ".join(failed))
+        pruned = RefreshJob.prune()
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write("Refreshed %d of %d feeds, deleted %d old "
+                            "refresh jobs\n" % (len(results) - len(failed),
+                                                len(results), pruned))
+
+def response_key(environ):
+    """
+    the MicroCache key for a request: its path and sorted query, the
+    Pacific date, the schedule version, and the codings it accepts.
+    None for requests with side effects, and until there's a schedule.
+    """
+    path = environ.get('PATH_INFO', '/')
+    if (path in ('/refresh', '/schedule/changes', '/metrics') or
+        path.startswith(('/refresh/', '/tasks/', '/admin/'))):
+        return None
+    sched = Schedule.cached()
+    if not sched or not sched.has_events():
+        return None
+    query = parse_qsl(environ.get('QUERY_STRING', ''), keep_blank_values=True)
+    codings = accepted_codings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+    return (path, tuple(sorted(query)), oraclenow().date().isoformat(),
+            sched.url, sched.timestamp,
+            tuple(sorted(codings.intersection(('br', 'gzip')))))
 
-app = webapp2.WSGIApplication([
+microcache = MicroCache(webapp2.WSGIApplication([
+    webapp2.Route('/tasks/refresh', handler=RefreshAllTask),
+    webapp2.Route('/metrics', handler=MetricsPage),
+    webapp2.Route('/admin/admission', handler=AdmissionPage),
     webapp2.Route('/schedule.json', handler=SchedulePage),
+    webapp2.Route('/schedule/changes', handler=ChangesPage),
     webapp2.Route('/refresh', handler=RefreshPage),
+    webapp2.Route('/refresh/<job_id>', handler=RefreshStatusPage),
+    webapp2.Route('/range', handler=RangePage),
     webapp2.Route('/<verb>/<isodate>', handler=EightballPage),
     webapp2.Route('/<verb>/', handler=EightballPage),
     webapp2.Route('/<isodate>', handler=EightballPage),
     webapp2.Route('/', handler=EightballPage)
-])
+]), response_key)
+app = metrics.Instrumented(microcache)
+Schedule.on_refresh(microcache.clear)
+Schedule.on_refresh(notify_refreshed)
+metrics.collector(admission_metrics)